@@ -0,0 +1,123 @@
+"""In-memory stand-in for the parts of gspread that main.py uses.
+
+Every call sleeps for `latency` seconds to approximate a Sheets API round
+trip and is counted, so a run reports how many API calls it would have made.
+"""
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+MOVES_HEADERS = [
+    "Timestamp", "Name", "Email", "Phone", "Item", "Move Type", "Pickup Address",
+    "Dropoff Address", "Scheduled", "Distance", "Item Count", "Items", "Image Upload",
+    "Has Stairs", "Special Instructions", "Price", "Driver Pay", "Business Profit", "Driver Email", "Status",
+]
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: "FakeSpreadsheet", title: str, sheet_id: int, values: List[List] = None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.values = values or []
+
+    def _grid(self, a1: str) -> Dict:
+        grid = a1_range_to_grid_range(a1.split("!")[-1])
+        return {
+            "rows": (grid.get("startRowIndex", 0), grid.get("endRowIndex", len(self.values))),
+            "columns": (grid.get("startColumnIndex", 0), grid.get("endColumnIndex", 10**6)),
+        }
+
+    def _set(self, row: int, column: int, value):
+        while len(self.values) < row:
+            self.values.append([])
+        cells = self.values[row - 1]
+        while len(cells) < column:
+            cells.append("")
+        cells[column - 1] = value
+
+    def get_all_values(self, **kwargs) -> List[List]:
+        self.spreadsheet.call("values.get")
+        return [list(row) for row in self.values]
+
+    def batch_get(self, ranges: List[str], **kwargs) -> List[List[List]]:
+        self.spreadsheet.call("values:batchGet")
+        out = []
+        for a1 in ranges:
+            grid = self._grid(a1)
+            (first, last), (left, right) = grid["rows"], grid["columns"]
+            out.append([[str(value) for value in row[left:right]] for row in self.values[first:last]])
+        return out
+
+    def batch_update(self, data: List[Dict], **kwargs) -> Dict:
+        self.spreadsheet.call("values:batchUpdate")
+        self.spreadsheet.modified()
+        for update in data:
+            grid = self._grid(update["range"])
+            for i, row in enumerate(update["values"]):
+                for j, value in enumerate(row):
+                    self._set(grid["rows"][0] + 1 + i, grid["columns"][0] + 1 + j, value)
+        return {}
+
+    def append_rows(self, rows: List[List], **kwargs) -> Dict:
+        self.spreadsheet.call("values:append")
+        self.spreadsheet.modified()
+        start = len(self.values) + 1
+        self.values.extend(list(row) for row in rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:Z{len(self.values)}"}}
+
+class FakeSpreadsheet:
+    def __init__(self, latency: float = 0.0):
+        self.id = "bench"
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.revision = 0
+        self._lock = threading.Lock()
+        self.sheets = [FakeWorksheet(self, "Sheet1", 0, [list(MOVES_HEADERS)])]
+
+    def call(self, operation: str):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def modified(self):
+        with self._lock:
+            self.revision += 1
+
+    def get_lastUpdateTime(self) -> str:
+        self.call("drive.get")
+        return str(self.revision)
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self.call("spreadsheet.get")
+        return list(self.sheets)
+
+    def add_worksheet(self, title: str, values: List[List]) -> FakeWorksheet:
+        sheet = FakeWorksheet(self, title, len(self.sheets), values)
+        self.sheets.append(sheet)
+        return sheet
+
+    def batch_update(self, body: Dict) -> Dict:
+        self.call("spreadsheet:batchUpdate")
+        self.modified()
+        for request in body.get("requests", []):
+            if "deleteDimension" in request:
+                grid = request["deleteDimension"]["range"]
+                sheet = next(sheet for sheet in self.sheets if sheet.id == grid["sheetId"])
+                del sheet.values[grid["startIndex"]:grid["endIndex"]]
+        return {"replies": []}
+
+class FakeClient:
+    def __init__(self, spreadsheet: FakeSpreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        return self.spreadsheet
+
+def install(spreadsheet: FakeSpreadsheet):
+    """Make gspread.authorize() hand out the fake; call before main.py starts."""
+    gspread.authorize = lambda credentials, **kwargs: FakeClient(spreadsheet)
@@ -0,0 +1,69 @@
+"""Local Distance Matrix and Geocoding stand-in.
+
+Answers every request with a made-up but stable distance for the
+origin/destination pair, or stable coordinates near CENTER for an address,
+after sleeping `latency` seconds.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CENTER = (39.78, -89.65)  # Springfield; geocoded addresses land within about 7 miles
+
+def stable_fraction(text: str) -> float:
+    return int(hashlib.sha1(text.encode()).hexdigest()[:4], 16) / 0xFFFF
+
+class MapsStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, port: int = 0):
+        super().__init__(("127.0.0.1", port), DistanceMatrixHandler)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/maps/api/distancematrix/json"
+
+    @property
+    def geocode_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/maps/api/geocode/json"
+
+    def start(self) -> "MapsStub":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class DistanceMatrixHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server._lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.endswith("/geocode/json"):
+            address = params.get("address", [""])[0]
+            location = {
+                "lat": CENTER[0] + (stable_fraction(address) - 0.5) * 0.2,
+                "lng": CENTER[1] + (stable_fraction(address[::-1]) - 0.5) * 0.2,
+            }
+            body = json.dumps({"status": "OK", "results": [{"geometry": {"location": location}}]}).encode()
+        else:
+            pair = f"{params.get('origins', [''])[0]}|{params.get('destinations', [''])[0]}"
+            meters = 1609.34 * (1 + int(hashlib.sha1(pair.encode()).hexdigest()[:4], 16) % 60)
+            body = json.dumps({
+                "status": "OK",
+                "rows": [{"elements": [{"status": "OK", "distance": {"value": meters, "text": ""}}]}],
+            }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,262 @@
+"""Offline load test for main.py.
+
+Runs the app under uvicorn against local stand-ins for Google Sheets
+(fake_sheets), the Distance Matrix API (maps_stub) and SMTP (smtp_sink), then
+drives /submit, /driver/login, /driver/moves and /admin/drivers with a pool of
+concurrent clients and reports throughput and latency percentiles. Logged-in
+drivers report positions near the stub's addresses first, so /submit
+exercises auto-assignment, and the report counts how many moves were assigned.
+
+    python -m bench.run --requests 500 --concurrency 16 --maps-latency 0.15
+    python -m bench.run --save bench/baseline.json
+    python -m bench.run --compare bench/baseline.json --tolerance 0.25
+
+With --compare the run exits non-zero when a scenario's p90 latency or
+throughput is worse than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import requests
+
+from bench import fake_sheets
+from bench.maps_stub import CENTER, MapsStub
+from bench.smtp_sink import SMTPSink
+
+ADMIN = ("bench-admin", "bench-admin")
+DRIVER_PASSWORD = "bench-password"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def seed_spreadsheet(spreadsheet: fake_sheets.FakeSpreadsheet, drivers: int, moves: int) -> List[str]:
+    """Fill the fake with drivers and moves assigned to them; returns the driver emails."""
+    import main
+
+    emails = [f"driver{i}@bench.test" for i in range(drivers)]
+    spreadsheet.add_worksheet("Drivers", [list(main.DRIVERS_HEADERS)] + [
+        ["2025-01-01 00:00:00", f"Driver {i}", email, f"555-{i:04d}", random.choice(["Pickup Truck", "Van", "Box Truck", "Moving Truck"]),
+         f"L{i}", "", "", random.choice(["Active", "Active", "Inactive"]), 0, 0, 5, DRIVER_PASSWORD]
+        for i, email in enumerate(emails)
+    ])
+    moves_sheet = spreadsheet.sheets[0]
+    for i in range(moves):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1_700_000_000 + i * 60))
+        moves_sheet.values.append([
+            stamp, f"Customer {i}", f"customer{i}@bench.test", "555", "Sofa", "Home to Home",
+            f"{i} Pickup St", f"{i} Dropoff Ave", "", 10, 1, "Sofa", "", "No", "", 100, 70, 30,
+            emails[i % len(emails)], "Completed",  # History, so drivers are free for dispatch
+        ])
+    return emails
+
+def start_app(port: int):
+    import uvicorn
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base}/ready", timeout=1).status_code == 200:
+                return server, base
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    raise SystemExit("App did not become ready within 30 seconds")
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def run_scenario(name: str, call: Callable[[requests.Session, int], requests.Response], total: int, concurrency: int) -> Dict:
+    """Issue `total` calls from `concurrency` clients and summarise their latency."""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(total))
+    local = threading.local()
+
+    def worker():
+        nonlocal errors
+        local.session = requests.Session()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = call(local.session, index).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+def scenarios(base: str, emails: List[str], tokens: List[str], address_pool: int, assigned: List[int]) -> Dict[str, Callable]:
+    addresses = [(f"{i} Origin Rd, Springfield", f"{i * 7} Destination Blvd, Springfield") for i in range(address_pool)]
+
+    def submit(session, index):
+        pickup, destination = addresses[index % len(addresses)]
+        response = session.post(f"{base}/submit", json={
+            "name": f"Load {index}", "email": f"load{index}@bench.test", "phone": "555",
+            "move_type": "Home to Home", "pickup_address": pickup, "destination_address": destination,
+            "items": [{"item_name": "Sofa", "length": 84, "width": 36, "height": 34}],
+            "scheduled_date": "2030-01-01", "scheduled_time": "10:00",
+        })
+        if response.status_code == 200 and response.json().get("assigned_driver"):
+            assigned.append(index)
+        return response
+
+    def login(session, index):
+        return session.post(f"{base}/driver/login", json={"email": emails[index % len(emails)], "password": DRIVER_PASSWORD})
+
+    def driver_moves(session, index):
+        return session.get(f"{base}/driver/moves", params={"limit": 20},
+                           headers={"Authorization": f"Bearer {tokens[index % len(tokens)]}"})
+
+    def admin_drivers(session, index):
+        return session.get(f"{base}/admin/drivers", params={"limit": 50, "offset": (index * 50) % max(len(emails), 1)}, auth=ADMIN)
+
+    return {"submit": submit, "driver_login": login, "driver_moves": driver_moves, "admin_drivers": admin_drivers}
+
+def print_report(results: List[Dict], upstream: Dict):
+    print(f"{'scenario':<15}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for result in results:
+        print(f"{result['scenario']:<15}{result['requests']:>9}{result['errors']:>8}{result['throughput_rps']:>10.1f}"
+              f"{result['p50_ms']:>10.1f}{result['p90_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['max_ms']:>10.1f}")
+    print()
+    print(f"Sheets API calls: {dict(upstream['sheets_calls'])}")
+    print(f"Maps requests (Distance Matrix and Geocoding): {upstream['maps_requests']}")
+    print(f"Auto-assigned moves: {upstream['assigned_moves']}")
+    print(f"SMTP messages: {upstream['smtp_messages']} ({upstream['smtp_bytes']} bytes)")
+
+def regressions(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    found = []
+    previous = {result["scenario"]: result for result in baseline["results"]}
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        if result["p90_ms"] > before["p90_ms"] * (1 + tolerance):
+            found.append(f"{result['scenario']}: p90 {before['p90_ms']:.1f} ms -> {result['p90_ms']:.1f} ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            found.append(f"{result['scenario']}: {before['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+        if result["errors"] > before["errors"]:
+            found.append(f"{result['scenario']}: {before['errors']} -> {result['errors']} errors")
+    return found
+
+def main_cli(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=300, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default="submit,driver_login,driver_moves,admin_drivers")
+    parser.add_argument("--drivers", type=int, default=200, help="Drivers seeded into the fake sheet")
+    parser.add_argument("--moves", type=int, default=5000, help="Moves seeded into the fake sheet")
+    parser.add_argument("--address-pool", type=int, default=50, help="Distinct address pairs used by /submit")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="Seconds per fake Sheets call")
+    parser.add_argument("--maps-latency", type=float, default=0.15, help="Seconds per Distance Matrix request")
+    parser.add_argument("--smtp-latency", type=float, default=0.05, help="Seconds per SMTP message")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Write the results as JSON to this path")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed fractional slowdown before failing")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+
+    maps = MapsStub(latency=args.maps_latency).start()
+    smtp = SMTPSink(latency=args.smtp_latency).start()
+    spreadsheet = fake_sheets.FakeSpreadsheet(latency=args.sheets_latency)
+    workdir = tempfile.mkdtemp(prefix="pikup-bench-")
+    os.environ.update({
+        "GOOGLE_SHEET_ID": "bench",
+        "GOOGLE_MAPS_API_KEY": "bench",
+        "EMAIL_ADDRESS": "ops@bench.test",
+        "EMAIL_PASSWORD": "bench",
+        "ADMIN_USERNAME": ADMIN[0],
+        "ADMIN_PASSWORD": ADMIN[1],
+        "DRIVER_TOKEN_SECRET": "bench-secret",
+        "PIKUP_DB_PATH": os.path.join(workdir, "pikup.db"),
+        "OUTBOX_DIR": os.path.join(workdir, "outbox"),
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_STARTTLS": "0",
+        "DISTANCE_MATRIX_URL": maps.url,
+        "GEOCODE_URL": maps.geocode_url,
+    })
+    from google.oauth2.service_account import Credentials
+    Credentials.from_service_account_file = staticmethod(lambda *args, **kwargs: None)
+    fake_sheets.install(spreadsheet)
+
+    emails = seed_spreadsheet(spreadsheet, args.drivers, args.moves)
+    server, base = start_app(free_port())
+    tokens = [
+        requests.post(f"{base}/driver/login", json={"email": email, "password": DRIVER_PASSWORD}).json()["access_token"]
+        for email in emails[:20]
+    ]
+    for token in tokens:
+        requests.post(f"{base}/driver/location", headers={"Authorization": f"Bearer {token}"}, json={
+            "lat": CENTER[0] + random.uniform(-0.1, 0.1), "lng": CENTER[1] + random.uniform(-0.1, 0.1),
+        })
+    spreadsheet.calls.clear()
+
+    assigned: List[int] = []
+    available = scenarios(base, emails, tokens, args.address_pool, assigned)
+    results = []
+    for name in args.scenarios.split(","):
+        results.append(run_scenario(name, available[name], args.requests, args.concurrency))
+    time.sleep(1)  # Let the outbox and the sheet mirror catch up before counting upstream calls
+    server.should_exit = True
+
+    print_report(results, {
+        "sheets_calls": spreadsheet.calls,
+        "maps_requests": maps.requests,
+        "smtp_messages": smtp.messages,
+        "smtp_bytes": smtp.bytes,
+        "assigned_moves": len(assigned),
+    })
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,22 +1,66 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, HTTPException, status
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, HTTPException, status, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from typing import List, Optional, Dict
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
+from typing import BinaryIO, List, Optional, Dict, Tuple, Union
 import os
 import json
+import base64
+import csv
+import io
+import hashlib
+import hmac
+import math
+import mmap
+import struct
+import tempfile
+import uuid
 import datetime
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
 import gspread
 from google.oauth2.service_account import Credentials
 import requests
 import secrets
+import shutil
+import threading
+import time
+import asyncio
+import contextvars
+import fcntl
+import functools
+import random
+import re
+import sqlite3
+from collections import OrderedDict
+from contextlib import asynccontextmanager, closing, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from gspread.http_client import HTTPClient
+from gspread.utils import ValueRenderOption, rowcol_to_a1
+from urllib.parse import unquote, urlparse
 from pydantic import BaseModel
 
-app = FastAPI()
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: without Pillow photos are attached as uploaded
+    Image = None
+
+@asynccontextmanager
+async def lifespan(app):
+    background_tasks = [
+        asyncio.create_task(email_outbox.run()),
+        asyncio.create_task(sheet_sync.run()),
+        asyncio.create_task(admin_digest.run()),
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    smtp_connection.close()
+
+app = FastAPI(lifespan=lifespan)
 import pprint
 
 # Admin Authentication
@@ -42,6 +86,9 @@ class DriverLogin(BaseModel):
     email: str
     password: str
 
+class DriverRefresh(BaseModel):
+    refresh_token: str
+
 class DriverResponse(BaseModel):
     name: str
     email: str
@@ -54,46 +101,1492 @@ class DriverResponse(BaseModel):
     completed_moves: int
     rating: float
 
-# Driver Authentication
-def get_driver_credentials(credentials: HTTPBasicCredentials = Depends(security)):
-    try:
-        drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet("Drivers")
-        drivers = drivers_sheet.get_all_records()
-        
-        # Find driver by email
-        driver = next((d for d in drivers if d["email"] == credentials.username), None)
-        
-        if not driver:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Driver not found",
-                headers={"WWW-Authenticate": "Basic"},
+# Metrics
+# Histograms of every Sheets, Distance Matrix and SMTP call, labeled by
+# upstream and operation, plus request latency by route, served in Prometheus
+# text format from /metrics. Calls made while handling a request are also
+# collected as spans and returned in the response's Server-Timing header.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+request_spans: contextvars.ContextVar[Optional[List[Tuple[str, str, float]]]] = contextvars.ContextVar("request_spans", default=None)
+
+class Metrics:
+    HELP = {
+        "pikup_upstream_request_duration_seconds": "Time spent in calls to Sheets, Distance Matrix and SMTP.",
+        "pikup_http_request_duration_seconds": "Time to handle an HTTP request, by route.",
+    }
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List] = {}
+
+    def observe(self, name: str, labels: Dict[str, str], value: float):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, upstream: str, operation: str):
+        """Time the block as one call to an upstream, and add it to the current request's spans."""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(
+                "pikup_upstream_request_duration_seconds",
+                {"upstream": upstream, "operation": operation, "outcome": outcome},
+                elapsed,
             )
-            
-        # Check password from sheet
-        if credentials.password != driver.get("password", ""):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect password",
-                headers={"WWW-Authenticate": "Basic"},
+            spans = request_spans.get()
+            if spans is not None:
+                spans.append((upstream, operation, elapsed))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        current = None
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            if name != current:
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                current = name
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            prefix = label_text + "," if label_text else ""
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def sheets_operation(method: str, endpoint: str) -> str:
+    """A low-cardinality name for a Sheets API call, e.g. 'values:append' or 'values.get'."""
+    path = unquote(urlparse(endpoint).path)
+    if "/drive/" in path:
+        return f"drive.{method.lower()}"
+    rest = path.split("/spreadsheets/", 1)[-1].partition("/")[2]
+    for action in (":append", ":clear", ":batchGet", ":batchUpdate", ":batchClear"):
+        if path.endswith(action):
+            return ("values" if rest.startswith("values") else "spreadsheet") + action
+    if rest.startswith("values"):
+        return f"values.{method.lower()}"
+    return f"spreadsheet.{method.lower()}"
+
+# Circuit Breakers
+# Every call to Sheets, Maps or SMTP has a timeout, and each upstream has a
+# breaker. After BREAKER_FAILURE_THRESHOLD failures in a row the breaker
+# opens and calls fail at once with UpstreamUnavailable instead of tying up
+# threads. After BREAKER_RESET_TIMEOUT one trial call is let through: a
+# success closes the breaker, a failure opens it again.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # Seconds
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable; retry in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+def describe_error(error: Exception) -> str:
+    """Short, public-safe summary of an upstream error: URLs carry the Maps API key and customer
+    addresses, and SMTP errors can name recipients, so those are dropped."""
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) is not None:
+        return f"{type(error).__name__}: HTTP {response.status_code}"
+    message = re.sub(r"\S*(?:://|\?|@)\S*", "[redacted]", str(error))
+    return f"{type(error).__name__}: {message[:200]}"
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state only one trial call at a time may."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"{self.name} circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.last_error = describe_error(error)
+            if self._trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial:
+                    print(f"{self.name} circuit opened after {self.failures} failures: {self.last_error}")
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    @contextmanager
+    def guard(self, is_failure=lambda error: True):
+        """Fail fast while open; count the block's exceptions that `is_failure` blames on the upstream."""
+        if not self.allow():
+            raise UpstreamUnavailable(self.name, self.retry_after())
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                self.failure(e)
+            else:
+                self.success()
+            raise
+        else:
+            self.success()
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_after": round(self.retry_after(), 1),
+                "last_error": self.last_error,
+            }
+
+# Geocoding has its own breaker so its failures don't open Distance Matrix's
+breakers = {upstream: CircuitBreaker(upstream) for upstream in ("sheets", "maps", "geocode", "smtp")}
+
+# Sheets Scheduler
+# Every gspread request goes through one scheduler. A token bucket keeps us
+# under the per-minute Sheets quota, identical reads that overlap share one
+# call, and 429s, timeouts and 5xx are retried with jittered exponential
+# backoff (honouring Retry-After) instead of failing the sync pass.
+SHEETS_QUOTA_PER_MINUTE = int(os.getenv("SHEETS_QUOTA_PER_MINUTE", "60"))  # Read/write requests per minute per user
+SHEETS_BURST = int(os.getenv("SHEETS_BURST", "10"))
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE = 1.0  # Seconds
+SHEETS_BACKOFF_CAP = 64.0  # Seconds
+SHEETS_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+SHEETS_TIMEOUT = (10, float(os.getenv("SHEETS_TIMEOUT", "30")))  # Connect, read seconds
+SHEETS_APPEND_BATCH = int(os.getenv("SHEETS_APPEND_BATCH", "1000"))  # Rows per append_rows call
+
+def sheets_error_is_outage(error: Exception) -> bool:
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.code in SHEETS_RETRYABLE_STATUS
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+class SheetsScheduler:
+    def __init__(self, per_minute: int = SHEETS_QUOTA_PER_MINUTE, burst: int = SHEETS_BURST):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.throttled_seconds = 0.0
+        self.retries = 0
+
+    def _take_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                self._refilled = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                self.throttled_seconds += wait
+            time.sleep(wait)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return random.uniform(0, min(SHEETS_BACKOFF_CAP, SHEETS_BACKOFF_BASE * 2 ** attempt))
+
+    def _send(self, operation: str, send, idempotent: bool):
+        """Retry reads on throttling, 5xx and network errors. Writes (appends, row deletes) are only
+        retried on 429, which Google returns before applying anything; any other failure may have been
+        applied, so it fails the sync pass and the next pull reconciles."""
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            self._take_token()
+            try:
+                with breakers["sheets"].guard(sheets_error_is_outage), metrics.timer("sheets", operation):
+                    return send()
+            except (gspread.exceptions.APIError, requests.ConnectionError, requests.Timeout) as e:
+                status = getattr(e, "code", None)
+                if isinstance(e, gspread.exceptions.APIError) and status not in SHEETS_RETRYABLE_STATUS:
+                    raise
+                if not idempotent and status != 429:
+                    raise
+                if attempt == SHEETS_MAX_RETRIES:
+                    raise
+                delay = self._backoff(attempt, e)
+                with self._lock:
+                    self.retries += 1
+                print(f"Sheets {operation} failed ({status or type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def request(self, method: str, endpoint: str, key: Optional[str], send):
+        """Send one Sheets API request; callers passing the same read `key` while it's in flight share its result."""
+        operation = sheets_operation(method, endpoint)
+        idempotent = method.upper() == "GET"
+        with self._lock:
+            self.requests += 1
+            shared = self._in_flight.get(key) if key else None
+            if shared is not None:
+                self.coalesced += 1
+            elif key:
+                self._in_flight[key] = Future()
+        if shared is not None:
+            return shared.result()
+        if not key:
+            return self._send(operation, send, idempotent)
+        future = self._in_flight[key]
+        try:
+            result = self._send(operation, send, idempotent)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "quota_per_minute": round(self.rate * 60),
+                "tokens": round(self._tokens, 2),
+                "requests": self.requests,
+                "coalesced": self.coalesced,
+                "retries": self.retries,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+            }
+
+sheets_scheduler = SheetsScheduler()
+
+class ScheduledHTTPClient(HTTPClient):
+    """gspread HTTP client that sends every Sheets API request through sheets_scheduler."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = SHEETS_TIMEOUT
+
+    def request(self, method: str, endpoint: str, *args, **kwargs):
+        key = None
+        if method.lower() == "get":
+            key = json.dumps([endpoint, args, kwargs.get("params")], sort_keys=True, default=str)
+        send = functools.partial(super().request, method, endpoint, *args, **kwargs)
+        return sheets_scheduler.request(method, endpoint, key, send)
+
+# Upstream I/O
+# gspread, requests and smtplib all block, so every call to them is pushed onto
+# a thread pool owned by that upstream. The pool size is the concurrency limit,
+# so a backlog of slow SMTP sessions never delays Sheets or Maps calls, and
+# none of them stall the event loop.
+UPSTREAM_CONCURRENCY = {
+    "sheets": int(os.getenv("SHEETS_CONCURRENCY", "4")),
+    "maps": int(os.getenv("MAPS_CONCURRENCY", "8")),
+    "smtp": int(os.getenv("SMTP_CONCURRENCY", "2")),
+    "db": int(os.getenv("DB_CONCURRENCY", "4")),
+    "files": int(os.getenv("FILES_CONCURRENCY", "2")),
+    "auth": int(os.getenv("AUTH_CONCURRENCY", "2")),  # Password hashing is CPU-bound
+}
+
+io_pools = {
+    upstream: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{upstream}-io")
+    for upstream, workers in UPSTREAM_CONCURRENCY.items()
+}
+
+async def run_io(upstream: str, func, *args, **kwargs):
+    """Run a blocking upstream call on that upstream's pool and await the result."""
+    loop = asyncio.get_running_loop()
+    # Carry the request's context over so spans recorded in the thread reach it
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(io_pools[upstream], context.run, functools.partial(func, *args, **kwargs))
+
+# Local Storage
+PIKUP_DB_PATH = os.getenv("PIKUP_DB_PATH", "pikup.db")
+
+def db_connect():
+    conn = sqlite3.connect(PIKUP_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def ensure_column(conn, table: str, column: str, definition: str = ""):
+    """Add a column to a table created by an older version of this file."""
+    if column not in [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# Worker Coordination
+# Workers started with `uvicorn --workers N` on one host already share the
+# SQLite store, distance cache included. What they also need to agree on is
+# which of them talks to Google Sheets, and when an in-process copy is out of
+# date. The first is an flock the sync leader holds for as long as it lives;
+# the second is a small mmap'd file of generation counters that writers bump
+# and readers compare against on every lookup.
+SHARED_COUNTERS = ("drivers", "sync_wake", "sheets_pulled", "locations")
+
+class WorkerCoordination:
+    def __init__(self, path: str = f"{PIKUP_DB_PATH}.shared"):
+        self.path = path
+        self.leader = False
+        self._lock = threading.Lock()
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._leader_file = None
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    size = 8 * len(SHARED_COUNTERS)
+                    self._file = open(self.path, "a+b")
+                    if os.fstat(self._file.fileno()).st_size < size:
+                        self._file.truncate(size)
+                    self._map = mmap.mmap(self._file.fileno(), size)
+        return self._map
+
+    def generation(self, name: str) -> int:
+        return struct.unpack_from("<Q", self._mapped(), 8 * SHARED_COUNTERS.index(name))[0]
+
+    def bump(self, name: str) -> int:
+        """Advance a counter for every worker; returns the new value."""
+        shared = self._mapped()
+        offset = 8 * SHARED_COUNTERS.index(name)
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                value = struct.unpack_from("<Q", shared, offset)[0] + 1
+                struct.pack_into("<Q", shared, offset, value)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        return value
+
+    def try_lead(self) -> bool:
+        """Become the worker that syncs with Google Sheets, unless another live worker already is."""
+        if self.leader:
+            return True
+        lock_file = open(f"{PIKUP_DB_PATH}.leader.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._leader_file = lock_file  # Closing it (or exiting) hands leadership on
+        self.leader = True
+        return True
+
+coordination = WorkerCoordination()
+
+# Local Store
+# SQLite is the system of record for moves and drivers. Request handlers only
+# touch these tables; SheetSync mirrors them to and from Google Sheets, which
+# stays the ops team's view. Moves map to sheet1 by column position (A-T) and
+# drivers map to the Drivers tab by header name.
+MOVE_COLUMNS = [
+    "timestamp", "name", "email", "phone", "item", "move_type", "pickup_address",
+    "dropoff_address", "scheduled", "distance", "item_count", "items", "image_upload",
+    "has_stairs", "special_instructions", "price", "driver_pay", "business_profit",
+    "driver_email", "status",
+]
+# sheet1's header row; bootstrap fills in any that are blank, e.g. the Driver Email and Status columns added later
+MOVE_HEADERS = [
+    "Timestamp", "Name", "Email", "Phone", "Item", "Move Type", "Pickup Address",
+    "Dropoff Address", "Scheduled", "Distance", "Item Count", "Items", "Image Upload",
+    "Has Stairs", "Special Instructions", "Price", "Driver Pay", "Business Profit",
+    "Driver Email", "Status",
+]
+MOVE_COMPLETED = "Completed"
+
+def stats_delta_sql(row: str, sign: str) -> str:
+    """Statements adding (sign "+") or removing ("-") one move's share of the totals; row is NEW or OLD."""
+    completed = f"(LOWER(TRIM(COALESCE({row}.status, ''))) = 'completed')"
+    pay = f"CAST(COALESCE({row}.driver_pay, 0) AS REAL)"
+    return f"""
+        UPDATE business_stats SET
+            moves = moves {sign} 1,
+            completed_moves = completed_moves {sign} {completed},
+            revenue = revenue {sign} CAST(COALESCE({row}.price, 0) AS REAL),
+            driver_pay = driver_pay {sign} {pay},
+            business_profit = business_profit {sign} CAST(COALESCE({row}.business_profit, 0) AS REAL)
+        WHERE id = 1;
+        INSERT OR IGNORE INTO driver_stats (driver_email) SELECT {row}.driver_email WHERE COALESCE({row}.driver_email, '') != '';
+        UPDATE driver_stats SET
+            assigned_moves = assigned_moves {sign} 1,
+            completed_moves = completed_moves {sign} {completed},
+            total_earnings = total_earnings {sign} CASE WHEN {completed} THEN {pay} ELSE 0 END,
+            pending_earnings = pending_earnings {sign} CASE WHEN {completed} THEN 0 ELSE {pay} END
+        WHERE driver_email = {row}.driver_email;
+    """
+
+DRIVER_COLUMNS = [
+    "timestamp", "name", "email", "phone", "vehicle_type", "license_number", "address",
+    "notes", "status", "total_earnings", "completed_moves", "rating", "password",
+]
+
+def normalize_header(header) -> str:
+    """'Vehicle Type' -> 'vehicle_type', so either header style maps to a column."""
+    return re.sub(r"[^a-z0-9]+", "_", str(header).strip().lower()).strip("_")
+
+class LocalStore:
+    """The moves and drivers tables plus the bookkeeping SheetSync needs.
+
+    sheet_row is the row a record occupies in its sheet (NULL until it has been
+    appended), dirty_fields lists columns changed locally since the last push,
+    and version is bumped on every local change so a push only clears the
+    dirty marker for the version it actually wrote.
+    """
+
+    def __init__(self):
+        with closing(db_connect()) as conn, conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS moves (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sheet_row INTEGER,
+                    dirty_fields TEXT,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    {", ".join(MOVE_COLUMNS)}
+                )
+            """)
+            ensure_column(conn, "moves", "status")
+            conn.execute("CREATE INDEX IF NOT EXISTS moves_timestamp ON moves (timestamp)")
+            # Entries are ordered by (driver_email, id), so a driver's newest moves are one index range
+            conn.execute("CREATE INDEX IF NOT EXISTS moves_driver_email ON moves (driver_email)")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS drivers (
+                    email TEXT PRIMARY KEY,
+                    sheet_row INTEGER,
+                    dirty_fields TEXT,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    deleted INTEGER NOT NULL DEFAULT 0,
+                    {", ".join(column for column in DRIVER_COLUMNS if column != "email")}
+                )
+            """)
+            self._create_stats(conn)
+
+    # Aggregates
+    # Business-wide and per-driver totals are kept up to date by triggers on
+    # the moves table, so local writes and sheet merges alike adjust them by
+    # one move's worth and reading them is a primary-key lookup.
+    @staticmethod
+    def _create_stats(conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS business_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                moves INTEGER NOT NULL DEFAULT 0,
+                completed_moves INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                driver_pay REAL NOT NULL DEFAULT 0,
+                business_profit REAL NOT NULL DEFAULT 0
             )
-            
-        return driver
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS driver_stats (
+                driver_email TEXT PRIMARY KEY,
+                assigned_moves INTEGER NOT NULL DEFAULT 0,
+                completed_moves INTEGER NOT NULL DEFAULT 0,
+                total_earnings REAL NOT NULL DEFAULT 0,
+                pending_earnings REAL NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS moves_stats_insert AFTER INSERT ON moves BEGIN {stats_delta_sql('NEW', '+')} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS moves_stats_delete AFTER DELETE ON moves BEGIN {stats_delta_sql('OLD', '-')} END")
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS moves_stats_update
+            AFTER UPDATE OF price, driver_pay, business_profit, driver_email, status ON moves
+            BEGIN {stats_delta_sql('OLD', '-')} {stats_delta_sql('NEW', '+')} END
+        """)
+        if conn.execute("SELECT 1 FROM business_stats").fetchone() is None:
+            # First run with aggregates: total up the moves already stored, once
+            conn.execute("""
+                INSERT INTO business_stats (id, moves, completed_moves, revenue, driver_pay, business_profit)
+                SELECT 1, COUNT(*),
+                    COALESCE(SUM(LOWER(TRIM(COALESCE(status, ''))) = 'completed'), 0),
+                    COALESCE(SUM(CAST(COALESCE(price, 0) AS REAL)), 0),
+                    COALESCE(SUM(CAST(COALESCE(driver_pay, 0) AS REAL)), 0),
+                    COALESCE(SUM(CAST(COALESCE(business_profit, 0) AS REAL)), 0)
+                FROM moves
+            """)
+            conn.execute("""
+                INSERT OR REPLACE INTO driver_stats (driver_email, assigned_moves, completed_moves, total_earnings, pending_earnings)
+                SELECT driver_email, COUNT(*), SUM(done), SUM(CASE WHEN done THEN pay ELSE 0 END), SUM(CASE WHEN done THEN 0 ELSE pay END)
+                FROM (
+                    SELECT driver_email,
+                        LOWER(TRIM(COALESCE(status, ''))) = 'completed' AS done,
+                        CAST(COALESCE(driver_pay, 0) AS REAL) AS pay
+                    FROM moves WHERE COALESCE(driver_email, '') != ''
+                )
+                GROUP BY driver_email
+            """)
+
+    def business_stats(self) -> Dict:
+        with closing(db_connect()) as conn:
+            row = conn.execute("SELECT * FROM business_stats WHERE id = 1").fetchone()
+        stats = {key: row[key] for key in row.keys() if key != "id"}
+        return {key: round(value, 2) if isinstance(value, float) else value for key, value in stats.items()}
+
+    def driver_stats(self, email: Optional[str] = None) -> Union[Dict, List[Dict]]:
+        """One driver's totals (zeros if they have no moves yet), or every driver's with email=None."""
+        with closing(db_connect()) as conn:
+            if email is None:
+                rows = conn.execute("SELECT * FROM driver_stats ORDER BY total_earnings DESC").fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM driver_stats WHERE driver_email = ?", (email,)).fetchall()
+        stats = [
+            {key: round(row[key], 2) if isinstance(row[key], float) else row[key] for key in row.keys()}
+            for row in rows
+        ]
+        if email is None:
+            return stats
+        return stats[0] if stats else {
+            "driver_email": email, "assigned_moves": 0, "completed_moves": 0, "total_earnings": 0.0, "pending_earnings": 0.0,
+        }
+
+    def stale_driver_totals(self) -> Dict[str, Dict]:
+        """email -> fields for drivers whose total_earnings/completed_moves columns lag their aggregates."""
+        with closing(db_connect()) as conn:
+            rows = conn.execute("""
+                SELECT d.email, ROUND(COALESCE(s.total_earnings, 0), 2) AS total_earnings, COALESCE(s.completed_moves, 0) AS completed_moves
+                FROM drivers d LEFT JOIN driver_stats s ON s.driver_email = d.email
+                WHERE d.deleted = 0 AND (
+                    CAST(COALESCE(d.total_earnings, 0) AS REAL) != ROUND(COALESCE(s.total_earnings, 0), 2)
+                    OR CAST(COALESCE(d.completed_moves, 0) AS INTEGER) != COALESCE(s.completed_moves, 0)
+                )
+            """).fetchall()
+        return {row["email"]: {"total_earnings": row["total_earnings"], "completed_moves": row["completed_moves"]} for row in rows}
+
+    @staticmethod
+    def _mark_dirty(conn, table: str, key_column: str, key, fields: Dict):
+        row = conn.execute(f"SELECT dirty_fields FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        dirty = set(json.loads(row["dirty_fields"] or "[]")) | set(fields)
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        conn.execute(
+            f"UPDATE {table} SET {assignments}, dirty_fields = ?, version = version + 1 WHERE {key_column} = ?",
+            [*fields.values(), json.dumps(sorted(dirty)), key],
+        )
+
+    # Moves
+    def insert_move(self, move: Dict) -> int:
+        with closing(db_connect()) as conn, conn:
+            cursor = conn.execute(
+                f"INSERT INTO moves ({', '.join(MOVE_COLUMNS)}) VALUES ({', '.join('?' for _ in MOVE_COLUMNS)})",
+                [move.get(column, "") for column in MOVE_COLUMNS],
+            )
+            return cursor.lastrowid
+
+    def move(self, move_id: int) -> Optional[Dict]:
+        with closing(db_connect()) as conn:
+            row = conn.execute("SELECT * FROM moves WHERE id = ?", (move_id,)).fetchone()
+        return {"id": row["id"], **{column: row[column] for column in MOVE_COLUMNS}} if row else None
+
+    def update_move(self, move_id: int, fields: Dict):
+        with closing(db_connect()) as conn, conn:
+            self._mark_dirty(conn, "moves", "id", move_id, fields)
+
+    def driver_moves(
+        self,
+        email: str,
+        limit: int = 50,
+        before_id: Optional[int] = None,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+    ) -> Tuple[List[Dict], Optional[int]]:
+        """Newest-first page of a driver's moves and the cursor for the next page."""
+        conditions = ["driver_email = ?"]
+        params: List = [email]
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        if date_from is not None:
+            conditions.append("timestamp >= ?")
+            params.append(date_from.isoformat())
+        if date_to is not None:
+            conditions.append("timestamp < ?")
+            params.append((date_to + datetime.timedelta(days=1)).isoformat())
+        with closing(db_connect()) as conn:
+            rows = conn.execute(
+                f"SELECT * FROM moves WHERE {' AND '.join(conditions)} ORDER BY id DESC LIMIT ?",
+                [*params, limit + 1],
+            ).fetchall()
+        moves = [{"id": row["id"], **{column: row[column] for column in MOVE_COLUMNS}} for row in rows[:limit]]
+        next_cursor = moves[-1]["id"] if len(rows) > limit else None
+        return moves, next_cursor
+
+    def export_chunk(
+        self,
+        table: str,
+        after: int,
+        limit: int,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+    ) -> List[sqlite3.Row]:
+        """Up to `limit` live rows of a table with rowid above `after`, in rowid order."""
+        conditions = ["rowid > ?"]
+        params: List = [after]
+        if table == "drivers":
+            conditions.append("deleted = 0")
+        if date_from is not None:
+            conditions.append("timestamp >= ?")
+            params.append(date_from.isoformat())
+        if date_to is not None:
+            conditions.append("timestamp < ?")
+            params.append((date_to + datetime.timedelta(days=1)).isoformat())
+        with closing(db_connect()) as conn:
+            return conn.execute(
+                f"SELECT rowid AS export_rowid, * FROM {table} WHERE {' AND '.join(conditions)} ORDER BY rowid LIMIT ?",
+                [*params, limit],
+            ).fetchall()
+
+    # Drivers
+    def drivers(self) -> List[Dict]:
+        with closing(db_connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM drivers WHERE deleted = 0 ORDER BY sheet_row IS NULL, sheet_row, rowid"
+            ).fetchall()
+        return [{column: row[column] for column in DRIVER_COLUMNS} for row in rows]
+
+    def driver_emails(self, emails: List[str]) -> set:
+        """Which of these emails already belong to a driver."""
+        with closing(db_connect()) as conn:
+            return {
+                row["email"] for row in conn.execute(
+                    f"SELECT email FROM drivers WHERE email IN ({', '.join('?' for _ in emails)})", emails
+                )
+            }
+
+    def insert_drivers(self, drivers: List[Dict]):
+        """Insert every driver in one transaction."""
+        with closing(db_connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT INTO drivers ({', '.join(DRIVER_COLUMNS)}) VALUES ({', '.join('?' for _ in DRIVER_COLUMNS)})",
+                [[driver.get(column, "") for column in DRIVER_COLUMNS] for driver in drivers],
+            )
+
+    def update_drivers(self, updates: Dict[str, Dict]):
+        """Apply email -> fields updates in one transaction."""
+        with closing(db_connect()) as conn, conn:
+            for email, fields in updates.items():
+                if fields:
+                    self._mark_dirty(conn, "drivers", "email", email, fields)
+
+    def delete_driver(self, email: str):
+        with closing(db_connect()) as conn, conn:
+            # Rows already in the sheet are tombstoned until SheetSync removes them there
+            conn.execute("DELETE FROM drivers WHERE email = ? AND sheet_row IS NULL", (email,))
+            conn.execute("UPDATE drivers SET deleted = 1, version = version + 1 WHERE email = ?", (email,))
+
+    # Sheet mirroring
+    def unsynced(self, table: str, limit: int = SHEETS_APPEND_BATCH) -> List[sqlite3.Row]:
+        order = "id" if table == "moves" else "rowid"
+        with closing(db_connect()) as conn:
+            return conn.execute(
+                f"SELECT * FROM {table} WHERE sheet_row IS NULL ORDER BY {order} LIMIT ?", (limit,)
+            ).fetchall()
+
+    def dirty(self, table: str) -> List[sqlite3.Row]:
+        deleted = "AND deleted = 0" if table == "drivers" else ""
+        with closing(db_connect()) as conn:
+            return conn.execute(
+                f"SELECT * FROM {table} WHERE dirty_fields IS NOT NULL AND sheet_row IS NOT NULL {deleted}"
+            ).fetchall()
+
+    def mark_synced(self, table: str, key_column: str, synced: List[Tuple]):
+        """Record (key, version, sheet_row) triples as written to the sheet."""
+        with closing(db_connect()) as conn, conn:
+            for key, version, sheet_row in synced:
+                conn.execute(f"UPDATE {table} SET sheet_row = ? WHERE {key_column} = ?", (sheet_row, key))
+                conn.execute(
+                    f"UPDATE {table} SET dirty_fields = NULL WHERE {key_column} = ? AND version = ?", (key, version)
+                )
+
+    def deleted_drivers(self) -> List[sqlite3.Row]:
+        with closing(db_connect()) as conn:
+            return conn.execute(
+                "SELECT email, sheet_row FROM drivers WHERE deleted = 1 AND sheet_row IS NOT NULL ORDER BY sheet_row DESC"
+            ).fetchall()
+
+    def purge_drivers(self, deleted: List[sqlite3.Row]):
+        """Drop tombstones whose sheet rows are gone, shifting the rows below them up."""
+        with closing(db_connect()) as conn, conn:
+            for row in deleted:  # Highest row first, like the sheet deletes
+                conn.execute("DELETE FROM drivers WHERE email = ?", (row["email"],))
+                conn.execute("UPDATE drivers SET sheet_row = sheet_row - 1 WHERE sheet_row > ?", (row["sheet_row"],))
+
+    @staticmethod
+    def _rows_by_key(conn, table: str, key_column: str, keys: List[str]) -> Dict[str, sqlite3.Row]:
+        rows = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            for row in conn.execute(
+                f"SELECT * FROM {table} WHERE {key_column} IN ({', '.join('?' for _ in chunk)})", chunk
+            ):
+                rows[row[key_column]] = row
+        return rows
+
+    def merge_moves(self, rows: List[Tuple[int, List]], removed: Optional[List[str]] = None) -> bool:
+        """Apply sheet1 rows, given as (sheet row, values), to the moves table, matching by timestamp.
+
+        With removed=None the rows are the whole sheet and local moves missing
+        from it are deleted. Otherwise they are only the rows that changed
+        since the last pull, and removed lists the timestamps that left it.
+        """
+        sheet_moves = {}
+        for sheet_row, values in rows:
+            values = list(values) + [""] * (len(MOVE_COLUMNS) - len(values))
+            if values[0] and values[0] not in sheet_moves:
+                sheet_moves[values[0]] = (sheet_row, dict(zip(MOVE_COLUMNS, values)))
+        changed = False
+        with closing(db_connect()) as conn, conn:
+            if removed is None:
+                local = {row["timestamp"]: row for row in conn.execute("SELECT * FROM moves")}
+            else:
+                local = self._rows_by_key(conn, "moves", "timestamp", list(sheet_moves) + list(removed))
+            for timestamp, (sheet_row, move) in sheet_moves.items():
+                row = local.get(timestamp)
+                if row is None:
+                    conn.execute(
+                        f"INSERT INTO moves (sheet_row, {', '.join(MOVE_COLUMNS)}) VALUES (?, {', '.join('?' for _ in MOVE_COLUMNS)})",
+                        [sheet_row, *move.values()],
+                    )
+                    changed = True
+                elif row["dirty_fields"] is not None:
+                    conn.execute("UPDATE moves SET sheet_row = ? WHERE id = ?", (sheet_row, row["id"]))
+                elif row["sheet_row"] != sheet_row or any(row[column] != value for column, value in move.items()):
+                    conn.execute(
+                        f"UPDATE moves SET sheet_row = ?, {', '.join(f'{column} = ?' for column in MOVE_COLUMNS)} WHERE id = ? AND dirty_fields IS NULL",
+                        [sheet_row, *move.values(), row["id"]],
+                    )
+                    changed = True
+            for timestamp, row in local.items():
+                if row["sheet_row"] is not None and timestamp not in sheet_moves:
+                    conn.execute("DELETE FROM moves WHERE id = ?", (row["id"],))
+                    changed = True
+        return changed
+
+    def merge_drivers(self, headers: List[str], rows: List[Tuple[int, List]], removed: Optional[List[str]] = None) -> bool:
+        """Apply Drivers tab rows to the drivers table, matching by email; rows and removed as for merge_moves."""
+        columns = [normalize_header(header) for header in headers]
+        known = [column for column in DRIVER_COLUMNS if column in columns]
+        sheet_drivers = {}
+        for sheet_row, values in rows:
+            record = dict(zip(columns, list(values) + [""] * (len(columns) - len(values))))
+            if "password" in record:
+                record["password"] = str(record["password"])
+            email = record.get("email")
+            if email and email not in sheet_drivers:
+                sheet_drivers[email] = (sheet_row, {column: record[column] for column in known})
+        changed = False
+        with closing(db_connect()) as conn, conn:
+            if removed is None:
+                local = {row["email"]: row for row in conn.execute("SELECT * FROM drivers")}
+            else:
+                local = self._rows_by_key(conn, "drivers", "email", list(sheet_drivers) + list(removed))
+            for email, (sheet_row, driver) in sheet_drivers.items():
+                row = local.get(email)
+                if row is None:
+                    conn.execute(
+                        f"INSERT INTO drivers (sheet_row, {', '.join(driver)}) VALUES (?, {', '.join('?' for _ in driver)})",
+                        [sheet_row, *driver.values()],
+                    )
+                    changed = True
+                elif row["dirty_fields"] is not None or row["deleted"]:
+                    conn.execute("UPDATE drivers SET sheet_row = ? WHERE email = ?", (sheet_row, email))
+                elif row["sheet_row"] != sheet_row or any(row[column] != value for column, value in driver.items()):
+                    conn.execute(
+                        f"UPDATE drivers SET sheet_row = ?, {', '.join(f'{column} = ?' for column in driver)} WHERE email = ? AND dirty_fields IS NULL",
+                        [sheet_row, *driver.values(), email],
+                    )
+                    changed = True
+            for email, row in local.items():
+                if row["sheet_row"] is not None and email not in sheet_drivers:
+                    # Removed from the sheet by hand; local edits to it have nowhere to go
+                    conn.execute("DELETE FROM drivers WHERE email = ?", (email,))
+                    changed = True
+        return changed
+
+local_store = LocalStore()
+
+# SMTP
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"  # Off only for local sinks
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))  # Seconds per socket operation
+SMTP_MAX_MESSAGE_BYTES = int(os.getenv("SMTP_MAX_MESSAGE_BYTES", str(25 * 1024 * 1024)))  # Gmail's limit
+# Base64 turns every 57 bytes into a 78-byte line; this much attachment data still fits one message
+SMTP_MAX_ATTACHMENT_BYTES = SMTP_MAX_MESSAGE_BYTES * 57 // 78 - 256 * 1024
+
+def smtp_error_is_outage(error: Exception) -> bool:
+    # Rejections of one message or recipient say nothing about the server's health
+    return not isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError))
+
+class SMTPConnection:
+    """A single long-lived, logged-in SMTP session that is reopened if it drops."""
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with metrics.timer("smtp", "connect"):
+            server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            if SMTP_STARTTLS:
+                server.starttls()
+            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        self._server = server
+
+    def _with_session(self, send):
+        with self._lock, breakers["smtp"].guard(smtp_error_is_outage):
+            for attempt in range(2):
+                if self._server is None:
+                    self._connect()
+                try:
+                    return send(self._server)
+                except smtplib.SMTPServerDisconnected:
+                    # Gmail drops idle sessions; reconnect once and retry
+                    self._server = None
+                    if attempt:
+                        raise
+
+    def sendmail(self, sender: str, recipient: str, payload: bytes):
+        with metrics.timer("smtp", "send"):
+            self._with_session(lambda server: server.sendmail(sender, [recipient], payload))
+
+    def send_file(self, sender: str, recipient: str, path: str):
+        with metrics.timer("smtp", "send"):
+            self._with_session(lambda server: self._stream_data(server, sender, recipient, path))
+
+    @staticmethod
+    def _stream_data(server, sender: str, recipient: str, path: str):
+        """Like SMTP.sendmail(), but the message is streamed from disk in chunks."""
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(sender)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+        code, response = server.rcpt(recipient)
+        if code not in (250, 251):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused({recipient: (code, response)})
+        server.putcmd("data")
+        code, response = server.getreply()
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, response)
+        chunk = bytearray()
+        with open(path, "rb") as message:
+            for line in message:
+                if line.startswith(b"."):
+                    chunk += b"."  # Dot-stuffing, as in SMTP.data()
+                chunk += line
+                if len(chunk) >= 64 * 1024:
+                    server.send(bytes(chunk))
+                    chunk.clear()
+        if not chunk.endswith(b"\r\n"):
+            chunk += b"\r\n"
+        server.send(bytes(chunk) + b".\r\n")
+        code, response = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def close(self):
+        with self._lock:
+            if self._server is not None:
+                try:
+                    self._server.quit()
+                except Exception:
+                    pass
+                self._server = None
+
+smtp_connection = SMTPConnection()
+
+BASE64_CHUNK = 57 * 1024  # Whole base64 lines per read, so chunks encode independently
+
+def write_message(path: str, msg: MIMEMultipart, attachments: List[Tuple[str, BinaryIO]]):
+    """Write msg to path with CRLF line endings, appending attachments as base64 parts.
+
+    Attachments are read and encoded a chunk at a time, so building a message
+    with a dozen photos never needs more than one chunk in memory.
+    """
+    policy = msg.policy.clone(linesep="\r\n")
+    boundary = f"===============pikup{uuid.uuid4().hex}=="
+    msg.set_boundary(boundary)
+    rendered = msg.as_bytes(policy=policy)
+    closing_boundary = f"--{boundary}--".encode()
+    with open(path, "wb") as out:
+        out.write(rendered[:rendered.rindex(closing_boundary)])
+        for filename, content in attachments:
+            part = MIMEBase("application", "octet-stream")
+            part.add_header("Content-Transfer-Encoding", "base64")
+            part.add_header("Content-Disposition", "attachment", filename=filename or "attachment")
+            out.write(f"--{boundary}\r\n".encode())
+            out.write(part.as_bytes(policy=policy))
+            content.seek(0)
+            while True:
+                data = content.read(BASE64_CHUNK)
+                if not data:
+                    break
+                out.write(base64.encodebytes(data).replace(b"\n", b"\r\n"))
+        out.write(closing_boundary + b"\r\n")
+
+# Email Outbox
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))  # Seconds
+OUTBOX_LEASE = 120  # Seconds a claimed message is hidden from other senders
+OUTBOX_DIR = os.getenv("OUTBOX_DIR", "outbox")  # Rendered messages waiting to be sent
+
+class EmailOutbox:
+    """SQLite spool of outgoing emails, drained by a background sender.
+
+    Messages are rendered to files in OUTBOX_DIR and indexed here, so a request
+    only has to make local writes. The sender claims due messages by pushing their next_attempt_at past
+    a lease, which keeps a crashed or concurrent sender from losing or
+    double-sending them, and reschedules failures with exponential backoff.
+    """
+
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+        with closing(db_connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender TEXT NOT NULL,
+                    recipient TEXT NOT NULL,
+                    subject TEXT,
+                    payload BLOB,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    sent_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+            ensure_column(conn, "outbox", "payload_path", "TEXT")
+        os.makedirs(OUTBOX_DIR, exist_ok=True)
+
+    def enqueue(self, msg, attachments: List[Tuple[str, BinaryIO]] = ()) -> int:
+        path = os.path.join(OUTBOX_DIR, f"{uuid.uuid4().hex}.eml")
+        write_message(path, msg, attachments)
+        now = time.time()
+        with closing(db_connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (sender, recipient, subject, payload_path, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (msg["From"], msg["To"], msg["Subject"], path, now, now),
+            )
+            return cursor.lastrowid
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def claim_due(self, limit: int = 20) -> List[sqlite3.Row]:
+        now = time.time()
+        with closing(db_connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                [(now + OUTBOX_LEASE, row["id"]) for row in rows],
+            )
+            conn.commit()
+            return rows
+
+    def mark_sent(self, message_id: int, payload_path: Optional[str] = None):
+        with closing(db_connect()) as conn, conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, payload = NULL, last_error = NULL WHERE id = ?",
+                (time.time(), message_id),
+            )
+        if payload_path and os.path.exists(payload_path):
+            os.remove(payload_path)
+
+    def mark_failed(self, message_id: int, attempts: int, error: str):
+        attempts += 1
+        with closing(db_connect()) as conn, conn:
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, error, message_id),
+                )
+            else:
+                delay = min(2 ** attempts * 5, 3600) * random.uniform(0.8, 1.2)
+                conn.execute(
+                    "UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                    (attempts, error, time.time() + delay, message_id),
+                )
+
+    def stats(self) -> Dict:
+        with closing(db_connect()) as conn:
+            counts = {row["status"]: row["count"] for row in conn.execute(
+                "SELECT status, COUNT(*) AS count FROM outbox GROUP BY status"
+            )}
+            oldest = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+            failures = conn.execute(
+                "SELECT id, recipient, subject, attempts, last_error, created_at FROM outbox "
+                "WHERE last_error IS NOT NULL ORDER BY id DESC LIMIT 20"
+            ).fetchall()
+        return {
+            "pending": counts.get("pending", 0),
+            "sent": counts.get("sent", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_age": round(time.time() - oldest, 1) if oldest else None,
+            "recent_errors": [dict(row) for row in failures],
+        }
+
+    def release(self, message_ids: List[int], delay: float):
+        """Hand claimed messages back untried, without spending an attempt."""
+        with closing(db_connect()) as conn, conn:
+            conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                [(time.time() + delay, message_id) for message_id in message_ids],
+            )
+
+    async def drain(self):
+        if breakers["smtp"].state == "open":
+            return
+        messages = await run_io("db", self.claim_due)
+        for index, message in enumerate(messages):
+            try:
+                if message["payload_path"]:
+                    await run_io("smtp", smtp_connection.send_file, message["sender"], message["recipient"], message["payload_path"])
+                else:
+                    await run_io("smtp", smtp_connection.sendmail, message["sender"], message["recipient"], message["payload"])
+            except UpstreamUnavailable as e:
+                # SMTP is down; the rest wait for the breaker rather than burning their attempts
+                await run_io("db", self.release, [pending["id"] for pending in messages[index:]], e.retry_after)
+                return
+            except Exception as e:
+                print(f"Email {message['id']} to {message['recipient']} failed: {str(e)}")
+                smtp_connection.close()
+                await run_io("db", self.mark_failed, message["id"], message["attempts"], str(e))
+            else:
+                await run_io("db", self.mark_sent, message["id"], message["payload_path"])
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"Outbox sender error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+email_outbox = EmailOutbox()
+
+# Admin Digest
+# With ADMIN_NOTIFY_MODE=digest, new-request emails to the admin are held
+# back and sent together once the oldest has waited ADMIN_DIGEST_INTERVAL
+# minutes or ADMIN_DIGEST_MAX_REQUESTS have piled up, photos included. Moves
+# scheduled within ADMIN_URGENT_HOURS still go out on their own right away.
+ADMIN_NOTIFY_MODE = os.getenv("ADMIN_NOTIFY_MODE", "immediate")  # "immediate" or "digest"
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "15")) * 60  # Seconds
+ADMIN_DIGEST_MAX_REQUESTS = int(os.getenv("ADMIN_DIGEST_MAX_REQUESTS", "25"))
+ADMIN_URGENT_HOURS = float(os.getenv("ADMIN_URGENT_HOURS", "24"))
+DIGEST_DIR = os.path.join(OUTBOX_DIR, "digest")  # Attachments waiting for the next digest
+
+def is_urgent(scheduled: Optional[datetime.datetime]) -> bool:
+    """Moves soon enough that the admin should hear now; unparseable dates count, to be safe."""
+    return scheduled is None or scheduled - datetime.datetime.now() <= datetime.timedelta(hours=ADMIN_URGENT_HOURS)
+
+class AdminDigest:
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+        with closing(db_connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS admin_digest (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    subject TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    attachments TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+        os.makedirs(DIGEST_DIR, exist_ok=True)
+
+    def add(self, subject: str, body: str, attachments: List[Tuple[str, BinaryIO]] = ()):
+        """Hold one notification for the next digest, copying its attachments to disk."""
+        stored = []
+        for filename, content in attachments:
+            path = os.path.join(DIGEST_DIR, uuid.uuid4().hex)
+            content.seek(0)
+            with open(path, "wb") as out:
+                shutil.copyfileobj(content, out)
+            stored.append([filename, path])
+        with closing(db_connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO admin_digest (subject, body, attachments, created_at) VALUES (?, ?, ?, ?)",
+                (subject, body, json.dumps(stored), time.time()),
+            )
+
+    def held_bytes(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(DIGEST_DIR) if entry.is_file())
+
+    def due(self) -> bool:
+        with closing(db_connect()) as conn:
+            count, oldest = conn.execute("SELECT COUNT(*), MIN(created_at) FROM admin_digest").fetchone()
+        if count and self.held_bytes() >= SMTP_MAX_ATTACHMENT_BYTES:
+            return True  # A full message's worth of photos; waiting only makes the digest bigger
+        return count >= ADMIN_DIGEST_MAX_REQUESTS or (oldest is not None and time.time() - oldest >= ADMIN_DIGEST_INTERVAL)
+
+    def _batches(self, entries: List[sqlite3.Row]) -> List[List[Tuple[sqlite3.Row, List, List[str]]]]:
+        """Split held entries into messages whose photos fit SMTP_MAX_ATTACHMENT_BYTES.
+
+        Each item is (entry, [(filename, path, size)], missing filenames). An entry
+        too big for any message still gets one to itself rather than being held.
+        """
+        batches, batch, batch_bytes = [], [], 0
+        for entry in entries:
+            files, missing = [], []
+            for filename, path in json.loads(entry["attachments"]):
+                try:
+                    files.append((filename, path, os.path.getsize(path)))
+                except OSError:
+                    print(f"Admin digest: photo {filename} for {entry['subject']} is missing, sending without it")
+                    missing.append(filename)
+            size = sum(file_size for _, _, file_size in files)
+            if batch and batch_bytes + size > SMTP_MAX_ATTACHMENT_BYTES:
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append((entry, files, missing))
+            batch_bytes += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _enqueue(self, batch: List[Tuple[sqlite3.Row, List, List[str]]], part: int, parts: int) -> int:
+        msg = MIMEMultipart()
+        msg["From"] = EMAIL_ADDRESS
+        msg["To"] = EMAIL_ADDRESS
+        msg["Subject"] = f"PikUp digest: {len(batch)} new move request{'s' if len(batch) != 1 else ''}" + (
+            f" (part {part} of {parts})" if parts > 1 else ""
+        )
+        summary = "\n".join(f"{number}. {entry['subject']}" for number, (entry, _, _) in enumerate(batch, start=1))
+        details = "\n".join(
+            f"----- Request {number} of {len(batch)} -----\n{entry['body']}"
+            + "".join(f"\n(Photo {filename} could not be attached)" for filename in missing)
+            for number, (entry, _, missing) in enumerate(batch, start=1)
+        )
+        msg.attach(MIMEText(f"{summary}\n\n{details}", "plain"))
+        attachments = []
+        try:
+            for number, (_, files, _) in enumerate(batch, start=1):
+                for filename, path, _ in files:
+                    attachments.append((f"request{number}-{filename or 'attachment'}", open(path, "rb")))
+            return email_outbox.enqueue(msg, attachments)
+        finally:
+            for _, content in attachments:
+                content.close()
+
+    def flush(self) -> List[int]:
+        """Move everything held into outbox messages, each within the SMTP size limit; returns their ids."""
+        with closing(db_connect()) as conn:
+            entries = conn.execute("SELECT * FROM admin_digest ORDER BY id").fetchall()
+        batches = self._batches(entries)
+        message_ids = []
+        for part, batch in enumerate(batches, start=1):
+            message_ids.append(self._enqueue(batch, part, len(batches)))
+            # Each part is released as soon as it's queued, so a crash re-sends at most the rest
+            with closing(db_connect()) as conn, conn:
+                conn.executemany("DELETE FROM admin_digest WHERE id = ?", [(entry["id"],) for entry, _, _ in batch])
+            for _, files, _ in batch:
+                for _, path, _ in files:
+                    os.remove(path)
+        return message_ids
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """Flush due digests; only the coordination leader does, so each goes out once."""
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                if coordination.leader and await run_io("db", self.due):
+                    if await run_io("db", self.flush):
+                        email_outbox.wake()
+            except Exception as e:
+                print(f"Admin digest error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+admin_digest = AdminDigest()
+
+# Drivers Repository
+DRIVERS_CACHE_TTL = int(os.getenv("DRIVERS_CACHE_TTL", "60"))  # Seconds
+
+class DriversRepository:
+    """In-process copy of the local drivers table, indexed by email.
+
+    Reloaded from SQLite once the TTL expires or when any worker bumps the
+    shared "drivers" generation, which every write and every pull that changes
+    a driver does. add/update/delete write to the local store first and then
+    patch the cached copy, so reads stay in memory.
+    """
+
+    def __init__(self, ttl: int = DRIVERS_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._by_email: Dict[str, dict] = {}
+        self._loaded_at = 0.0
+        self._version: Optional[str] = None
+        self._generation: Optional[int] = None
+
+    def refresh(self):
+        generation = coordination.generation("drivers")
+        drivers = local_store.drivers()
+        with self._lock:
+            self._generation = generation
+            by_email = {driver["email"]: driver for driver in drivers}
+            if by_email != self._by_email:
+                self._by_email = by_email
+                self._version = None
+            self._loaded_at = time.monotonic()
+
+    @property
+    def version(self) -> str:
+        """Content hash of every cached driver; the same data gives the same value in every worker."""
+        with self._lock:
+            if self._version is None:
+                content = json.dumps(list(self._by_email.values()), sort_keys=True, default=str)
+                self._version = hashlib.sha1(content.encode()).hexdigest()
+            return self._version
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl or coordination.generation("drivers") != self._generation
+
+    def _written(self):
+        """Tell other workers about a local write; keep our patched copy if nobody else wrote meanwhile."""
+        generation = coordination.bump("drivers")
+        with self._lock:
+            if self._generation == generation - 1:
+                self._generation = generation
+
+    def _ensure_fresh(self):
+        if self.stale:
+            self.refresh()
+
+    async def ensure_fresh(self):
+        """Reload off the event loop if the TTL has expired."""
+        if self.stale:
+            await run_io("db", self.refresh)
+
+    def get(self, email: str) -> Optional[dict]:
+        self._ensure_fresh()
+        with self._lock:
+            return self._by_email.get(email)
+
+    def all(self) -> List[dict]:
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._by_email.values())
+
+    def add(self, driver: Dict):
+        self.add_many([driver])
+
+    def add_many(self, drivers: List[Dict]):
+        local_store.insert_drivers(drivers)
+        with self._lock:
+            for driver in drivers:
+                self._by_email[driver["email"]] = {column: driver.get(column, "") for column in DRIVER_COLUMNS}
+            self._version = None
+        self._written()
+        sheet_sync.wake()
+
+    def update(self, email: str, fields: Dict):
+        self.update_many({email: fields})
+
+    def update_many(self, updates: Dict[str, Dict]):
+        local_store.update_drivers(updates)
+        with self._lock:
+            for email, fields in updates.items():
+                if email in self._by_email:
+                    self._by_email[email].update(fields)
+            self._version = None
+        self._written()
+        sheet_sync.wake()
+
+    def delete(self, email: str):
+        local_store.delete_driver(email)
+        with self._lock:
+            self._by_email.pop(email, None)
+            self._version = None
+        self._written()
+        sheet_sync.wake()
+
+drivers_repo = DriversRepository()
+
+# Driver Authentication
+# Drivers log in once with email and password and get a short-lived access
+# token plus a longer-lived refresh token. Both are HS256 JWTs, so checking
+# one is an HMAC over the token and never touches storage. Passwords are
+# stored as salted PBKDF2 hashes; a plaintext password typed into the sheet
+# is upgraded to a hash the first time that driver logs in.
+DRIVER_TOKEN_TTL = int(os.getenv("DRIVER_TOKEN_TTL", str(15 * 60)))  # Seconds
+DRIVER_REFRESH_TTL = int(os.getenv("DRIVER_REFRESH_TTL", str(30 * 24 * 3600)))  # Seconds
+PASSWORD_HASH_ITERATIONS = 200_000
+PASSWORD_HASH_PREFIX = "pbkdf2_sha256"
+
+bearer = HTTPBearer(auto_error=False)
+
+@functools.lru_cache(maxsize=None)
+def token_secret() -> bytes:
+    """DRIVER_TOKEN_SECRET, or a random secret shared by every worker through SQLite."""
+    if os.getenv("DRIVER_TOKEN_SECRET"):
+        return os.getenv("DRIVER_TOKEN_SECRET").encode()
+    with closing(db_connect()) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS app_settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute(
+            "INSERT OR IGNORE INTO app_settings (key, value) VALUES ('driver_token_secret', ?)",
+            (secrets.token_hex(32),),
+        )
+        return conn.execute("SELECT value FROM app_settings WHERE key = 'driver_token_secret'").fetchone()[0].encode()
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PASSWORD_HASH_ITERATIONS)
+    return f"{PASSWORD_HASH_PREFIX}${PASSWORD_HASH_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+def check_password(password: str, stored) -> bool:
+    stored = str(stored or "")
+    if not stored.startswith(PASSWORD_HASH_PREFIX + "$"):
+        return bool(stored) and secrets.compare_digest(password.encode(), stored.encode())
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    except ValueError:  # Hand-edited or truncated hash in the sheet; nothing can match it
+        return False
+    return hmac.compare_digest(candidate.hex(), digest)
+
+def password_fingerprint(stored) -> str:
+    """Changes whenever the stored password does; refresh tokens carry it."""
+    return hashlib.sha256(str(stored or "").encode()).hexdigest()[:16]
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def issue_token(claims: Dict, ttl: int) -> str:
+    now = int(time.time())
+    header = _b64url(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = _b64url(json.dumps({**claims, "iat": now, "exp": now + ttl}).encode())
+    signature = _b64url(hmac.new(token_secret(), f"{header}.{payload}".encode(), hashlib.sha256).digest())
+    return f"{header}.{payload}.{signature}"
+
+def verify_token(token: str, token_type: str) -> Optional[Dict]:
+    """The token's claims if it is well-formed, correctly signed, unexpired and of token_type."""
+    try:
+        header, payload, signature = token.split(".")
+        expected = _b64url(hmac.new(token_secret(), f"{header}.{payload}".encode(), hashlib.sha256).digest())
+        if not hmac.compare_digest(signature, expected):
+            return None
+        claims = json.loads(_b64url_decode(payload))
+    except ValueError:
+        return None
+    if claims.get("typ") != token_type or claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
+def issue_driver_tokens(driver: Dict) -> Dict:
+    return {
+        "access_token": issue_token({"sub": driver["email"], "typ": "access"}, DRIVER_TOKEN_TTL),
+        "refresh_token": issue_token(
+            {"sub": driver["email"], "typ": "refresh", "pwd": password_fingerprint(driver.get("password"))},
+            DRIVER_REFRESH_TTL,
+        ),
+        "token_type": "bearer",
+        "expires_in": DRIVER_TOKEN_TTL,
+    }
+
+async def get_driver_credentials(token: Optional[HTTPAuthorizationCredentials] = Depends(bearer)):
+    claims = verify_token(token.credentials, "access") if token else None
+    if not claims:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        await drivers_repo.ensure_fresh()
+        driver = drivers_repo.get(claims["sub"])
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+    if not driver:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Driver not found",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return driver
 
 # Driver Endpoints
 @app.post("/driver/login")
 async def driver_login(login_data: DriverLogin):
     try:
-        drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet("Drivers")
-        drivers = drivers_sheet.get_all_records()
-        
-        # Find driver by email
-        driver = next((d for d in drivers if d["email"] == login_data.email), None)
+        await drivers_repo.ensure_fresh()
+        driver = drivers_repo.get(login_data.email)
         
         if not driver:
             raise HTTPException(
@@ -101,12 +1594,16 @@ async def driver_login(login_data: DriverLogin):
                 detail="Driver not found"
             )
             
-        # Check password from sheet
-        if login_data.password != driver.get("password", ""):
+        stored_password = driver.get("password", "")
+        if not await run_io("auth", check_password, login_data.password, stored_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect password"
             )
+        if not str(stored_password).startswith(PASSWORD_HASH_PREFIX + "$"):
+            # Replace the plaintext password from the sheet with its hash
+            hashed = await run_io("auth", hash_password, login_data.password)
+            await run_io("db", drivers_repo.update, driver["email"], {"password": hashed})
             
         return {
             "status": "success",
@@ -115,17 +1612,33 @@ async def driver_login(login_data: DriverLogin):
                 "name": driver["name"],
                 "email": driver["email"],
                 "status": driver["status"]
-            }
+            },
+            **issue_driver_tokens(driver)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+@app.post("/driver/refresh")
+async def refresh_driver_token(refresh_data: DriverRefresh):
+    claims = verify_token(refresh_data.refresh_token, "refresh")
+    if not claims:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired refresh token")
+    await drivers_repo.ensure_fresh()
+    driver = drivers_repo.get(claims["sub"])
+    # A deleted driver or a changed password ends every session
+    if not driver or claims.get("pwd") != password_fingerprint(driver.get("password")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Session is no longer valid")
+    return {"status": "success", **issue_driver_tokens(driver)}
+
 @app.get("/driver/profile")
 async def get_driver_profile(credentials: HTTPBasicCredentials = Depends(get_driver_credentials)):
     try:
+        stats = await run_io("db", local_store.driver_stats, credentials["email"])
         return {
             "status": "success",
             "driver": {
@@ -136,9 +1649,11 @@ async def get_driver_profile(credentials: HTTPBasicCredentials = Depends(get_dri
                 "license_number": credentials["license_number"],
                 "address": credentials["address"],
                 "status": credentials["status"],
-                "total_earnings": float(credentials["total_earnings"]),
-                "completed_moves": int(credentials["completed_moves"]),
-                "rating": float(credentials["rating"])
+                "total_earnings": stats["total_earnings"],
+                "pending_earnings": stats["pending_earnings"],
+                "completed_moves": stats["completed_moves"],
+                "assigned_moves": stats["assigned_moves"],
+                "rating": float(credentials["rating"] or 0)
             }
         }
     except Exception as e:
@@ -148,21 +1663,22 @@ async def get_driver_profile(credentials: HTTPBasicCredentials = Depends(get_dri
         )
 
 @app.get("/driver/moves")
-async def get_driver_moves(credentials: HTTPBasicCredentials = Depends(get_driver_credentials)):
+async def get_driver_moves(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = None,
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    credentials: HTTPBasicCredentials = Depends(get_driver_credentials)
+):
     try:
-        # Get moves from the main worksheet
-        moves_sheet = gc.open_by_key(GOOGLE_SHEET_ID).sheet1
-        moves = moves_sheet.get_all_records()
-        
-        # Filter moves for this driver (in a real app, you'd have a driver_id field)
-        driver_moves = [
-            move for move in moves 
-            if move.get("driver_email") == credentials["email"]
-        ]
+        driver_moves, next_cursor = await run_io(
+            "db", local_store.driver_moves, credentials["email"], limit, cursor, date_from, date_to
+        )
         
         return {
             "status": "success",
-            "moves": driver_moves
+            "moves": driver_moves,
+            "next_cursor": next_cursor
         }
     except Exception as e:
         raise HTTPException(
@@ -171,6 +1687,27 @@ async def get_driver_moves(credentials: HTTPBasicCredentials = Depends(get_drive
         )
 
 # Driver Management Endpoints
+DRIVER_EDITABLE_FIELDS = ["name", "phone", "vehicle_type", "license_number", "address", "notes", "status"]
+DRIVER_REQUIRED_FIELDS = ["name", "email", "phone", "vehicle_type", "license_number"]
+MAX_BULK_DRIVERS = int(os.getenv("MAX_BULK_DRIVERS", str(SHEETS_APPEND_BATCH)))  # One import, one append
+
+def new_driver_record(driver_data: Dict, password_hash: str) -> Dict:
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "name": driver_data["name"],
+        "email": driver_data["email"],
+        "phone": driver_data["phone"],
+        "vehicle_type": driver_data["vehicle_type"],
+        "license_number": driver_data["license_number"],
+        "address": driver_data.get("address", ""),
+        "notes": driver_data.get("notes", ""),
+        "status": "Active",
+        "total_earnings": 0,
+        "completed_moves": 0,
+        "rating": 0,
+        "password": password_hash,
+    }
+
 @app.post("/admin/drivers")
 async def add_driver(
     driver_data: Dict,
@@ -178,48 +1715,218 @@ async def add_driver(
 ):
     try:
         # Validate required fields
-        required_fields = ["name", "email", "phone", "vehicle_type", "license_number"]
-        for field in required_fields:
+        for field in DRIVER_REQUIRED_FIELDS:
             if field not in driver_data:
                 raise HTTPException(status_code=400, detail=f"Missing required field: {field}")
         
-        # Get the drivers worksheet
-        drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet("Drivers")
-        
         # Check if driver email already exists
-        existing_drivers = drivers_sheet.get_all_records()
-        if any(driver["email"] == driver_data["email"] for driver in existing_drivers):
+        await drivers_repo.ensure_fresh()
+        if drivers_repo.get(driver_data["email"]):
             raise HTTPException(status_code=400, detail="Driver with this email already exists")
         
         # Prepare driver data
-        driver_row = [
-            datetime.datetime.now().isoformat(),  # Timestamp
-            driver_data["name"],
-            driver_data["email"],
-            driver_data["phone"],
-            driver_data["vehicle_type"],
-            driver_data["license_number"],
-            driver_data.get("address", ""),
-            driver_data.get("notes", ""),
-            "Active",  # Status
-            "0",  # Total Earnings
-            "0",  # Completed Moves
-            "0"   # Rating
-        ]
+        password_hash = await run_io("auth", hash_password, driver_data["password"]) if driver_data.get("password") else ""
+        driver = new_driver_record(driver_data, password_hash)
         
-        # Add to sheet
-        drivers_sheet.append_row(driver_row)
+        # Add to the local store; SheetSync appends it to the sheet
+        await run_io("db", drivers_repo.add, driver)
         
         return {"status": "success", "message": "Driver added successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def parse_bulk_drivers(content_type: str, body: bytes) -> List[Dict]:
+    """Rows from a JSON list (or {"drivers": [...]}) or a CSV with a header row.
+
+    CSV headers may be written either way ("Vehicle Type" or vehicle_type).
+    """
+    if "csv" in content_type:
+        reader = csv.reader(io.StringIO(body.decode("utf-8-sig")))
+        headers = [normalize_header(header) for header in next(reader, [])]
+        return [
+            {header: value.strip() for header, value in zip(headers, row) if value.strip()}
+            for row in reader if any(value.strip() for value in row)
+        ]
+    rows = json.loads(body)
+    if isinstance(rows, dict):
+        rows = rows.get("drivers")
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('Expected a list of drivers or {"drivers": [...]}')
+    return rows
+
+@app.post("/admin/drivers/bulk")
+async def add_drivers_bulk(
+    request: Request,
+    credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
+):
+    """Add many drivers at once from JSON or CSV.
+
+    Every row is validated and checked for duplicates against one snapshot of
+    the drivers and against earlier rows in the batch. Valid rows are written
+    in one transaction and reach the sheet in one append; the response has a
+    result for every row.
+    """
+    try:
+        rows = parse_bulk_drivers(request.headers.get("content-type", ""), await request.body())
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read drivers: {str(e)}")
+    if len(rows) > MAX_BULK_DRIVERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_DRIVERS} drivers per request.")
+
+    try:
+        await drivers_repo.ensure_fresh()
+        existing = {driver["email"].lower() for driver in drivers_repo.all()}
+        results = []
+        accepted: Dict[str, int] = {}  # lowercased email -> row number
+        valid = []
+        for number, row in enumerate(rows, start=1):
+            row = {key: str(value).strip() for key, value in row.items() if value is not None}
+            email = row.get("email", "")
+            missing = [field for field in DRIVER_REQUIRED_FIELDS if not row.get(field)]
+            if missing:
+                detail = f"Missing required field: {', '.join(missing)}"
+            elif not re.fullmatch(r"[^@\s]+@[^@\s]+\.[^@\s]+", email):
+                detail = "Invalid email address"
+            elif email.lower() in existing:
+                detail = "Driver with this email already exists"
+            elif email.lower() in accepted:
+                detail = f"Duplicate of row {accepted[email.lower()]}"
+            else:
+                accepted[email.lower()] = number
+                valid.append((number, row))
+                results.append({"row": number, "email": email, "status": "created"})
+                continue
+            results.append({"row": number, "email": email, "status": "error", "detail": detail})
+
+        hashes = await asyncio.gather(*[
+            run_io("auth", hash_password, row["password"]) if row.get("password") else asyncio.sleep(0, "")
+            for _, row in valid
+        ])
+        drivers = [new_driver_record(row, password_hash) for (_, row), password_hash in zip(valid, hashes)]
+        while drivers:
+            try:
+                # One local transaction; SheetSync appends the batch with one append_rows
+                await run_io("db", drivers_repo.add_many, drivers)
+                break
+            except sqlite3.IntegrityError:
+                # Another request added some of these emails since the duplicate check
+                taken = await run_io("db", local_store.driver_emails, [driver["email"] for driver in drivers])
+                if not taken:
+                    raise
+                drivers = [driver for driver in drivers if driver["email"] not in taken]
+                for result in results:
+                    if result["status"] == "created" and result["email"] in taken:
+                        result.update(status="error", detail="Driver with this email already exists")
+
+        return {
+            "status": "success",
+            "created": len(drivers),
+            "failed": len(results) - len(drivers),
+            "results": results,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Serialized /admin/drivers pages keyed by (drivers version, query); an
+# unchanged dashboard refresh is answered from here or with a 304
+drivers_page_cache: OrderedDict = OrderedDict()
+DRIVERS_PAGE_CACHE_SIZE = 64
+
+def render_drivers_page(
+    status_filter: Optional[str],
+    vehicle_type: Optional[str],
+    fields: Optional[str],
+    limit: Optional[int],
+    offset: int,
+) -> Tuple[str, bytes]:
+    """ETag and JSON body for one page of drivers, built once per drivers version."""
+    version = drivers_repo.version
+    key = (version, status_filter, vehicle_type, fields, limit, offset)
+    cached = drivers_page_cache.get(key)
+    if cached is not None:
+        drivers_page_cache.move_to_end(key)
+        return cached
+    
+    drivers = [
+        driver for driver in drivers_repo.all()
+        if (status_filter is None or driver.get("status") == status_filter)
+        and (vehicle_type is None or driver.get("vehicle_type") == vehicle_type)
+    ]
+    projection = [field for field in fields.split(",") if field] if fields else DRIVER_COLUMNS
+    page = drivers[offset:offset + limit] if limit is not None else drivers[offset:]
+    next_offset = offset + len(page) if offset + len(page) < len(drivers) else None
+    body = json.dumps({
+        "status": "success",
+        "drivers": [
+            {field: driver[field] for field in projection if field in driver and field != "password"}
+            for driver in page
+        ],
+        "total": len(drivers),
+        "offset": offset,
+        "next_offset": next_offset,
+    }, default=str).encode()
+    etag = '"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+    
+    if drivers_repo.version == version:
+        drivers_page_cache[key] = (etag, body)
+        while len(drivers_page_cache) > DRIVERS_PAGE_CACHE_SIZE:
+            drivers_page_cache.popitem(last=False)
+    return etag, body
+
 @app.get("/admin/drivers")
-async def get_drivers(credentials: HTTPBasicCredentials = Depends(get_admin_credentials)):
+async def get_drivers(
+    request: Request,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    vehicle_type: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
+):
+    try:
+        await drivers_repo.ensure_fresh()
+        etag, body = render_drivers_page(status_filter, vehicle_type, fields, limit, offset)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/admin/drivers")
+async def update_drivers(
+    driver_data: Dict,
+    credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
+):
+    """Bulk variant of PUT /admin/drivers/{email}: {"drivers": [{"email": ..., <fields>}, ...]}"""
     try:
-        drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet("Drivers")
-        drivers = drivers_sheet.get_all_records()
-        return {"status": "success", "drivers": drivers}
+        entries = driver_data.get("drivers")
+        if not isinstance(entries, list):
+            raise HTTPException(status_code=400, detail="Expected a list of drivers under \"drivers\"")
+        
+        await drivers_repo.ensure_fresh()
+        updates = {}
+        results = []
+        for entry in entries:
+            email = entry.get("email") if isinstance(entry, dict) else None
+            if not email or not drivers_repo.get(email):
+                results.append({"email": email, "status": "error", "detail": "Driver not found"})
+                continue
+            fields = {field: entry[field] for field in DRIVER_EDITABLE_FIELDS if field in entry}
+            if entry.get("password"):
+                fields["password"] = await run_io("auth", hash_password, entry["password"])
+            updates.setdefault(email, {}).update(fields)
+            results.append({"email": email, "status": "success"})
+        
+        await run_io("db", drivers_repo.update_many, updates)
+        
+        return {"status": "success", "updated": len(updates), "results": results}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -230,33 +1937,19 @@ async def update_driver(
     credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
 ):
     try:
-        drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet("Drivers")
-        drivers = drivers_sheet.get_all_records()
-        
-        # Find driver row
-        driver_row = None
-        for i, driver in enumerate(drivers, start=2):  # start=2 because sheet is 1-indexed and has header
-            if driver["email"] == email:
-                driver_row = i
-                break
-        
-        if not driver_row:
+        await drivers_repo.ensure_fresh()
+        if not drivers_repo.get(email):
             raise HTTPException(status_code=404, detail="Driver not found")
         
-        # Update fields
-        update_data = []
-        for field in ["name", "phone", "vehicle_type", "license_number", "address", "notes", "status"]:
-            if field in driver_data:
-                update_data.append(driver_data[field])
-            else:
-                # Get existing value
-                col_index = drivers_sheet.row_values(1).index(field) + 1
-                update_data.append(drivers_sheet.cell(driver_row, col_index).value)
-        
-        # Update row
-        drivers_sheet.update(f"B{driver_row}:H{driver_row}", [update_data])
+        # Update only the fields that were sent
+        update_data = {field: driver_data[field] for field in DRIVER_EDITABLE_FIELDS if field in driver_data}
+        if driver_data.get("password"):
+            update_data["password"] = await run_io("auth", hash_password, driver_data["password"])
+        await run_io("db", drivers_repo.update, email, update_data)
         
         return {"status": "success", "message": "Driver updated successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -266,40 +1959,144 @@ async def delete_driver(
     credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
 ):
     try:
-        drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet("Drivers")
-        drivers = drivers_sheet.get_all_records()
-        
-        # Find driver row
-        driver_row = None
-        for i, driver in enumerate(drivers, start=2):
-            if driver["email"] == email:
-                driver_row = i
-                break
-        
-        if not driver_row:
+        await drivers_repo.ensure_fresh()
+        if not drivers_repo.get(email):
             raise HTTPException(status_code=404, detail="Driver not found")
         
         # Delete row
-        drivers_sheet.delete_rows(driver_row)
+        await run_io("db", drivers_repo.delete, email)
         
         return {"status": "success", "message": "Driver deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/stats")
+async def get_stats(
+    include_drivers: bool = Query(False, alias="drivers"),
+    credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
+):
+    try:
+        response = {"status": "success", "business": await run_io("db", local_store.business_stats)}
+        if include_drivers:
+            response["drivers"] = await run_io("db", local_store.driver_stats)
+        return response
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/moves/{move_id}/complete")
+async def complete_move(
+    move_id: int,
+    credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
+):
+    """Mark a move completed, same as setting its Status column in the sheet."""
+    move = await run_io("db", local_store.move, move_id)
+    if move is None:
+        raise HTTPException(status_code=404, detail="Move not found")
+    if move["status"] != MOVE_COMPLETED:
+        # The stats triggers move its pay from pending to earned
+        await run_io("db", local_store.update_move, move_id, {"status": MOVE_COMPLETED})
+        sheet_sync.wake()
+    stats = await run_io("db", local_store.driver_stats, move["driver_email"]) if move["driver_email"] else None
+    return {"status": "success", "driver": stats}
+
+# Exports
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+async def export_rows(table: str, columns: List[str], export_format: str, **filters):
+    """Yield a table as CSV or NDJSON, EXPORT_CHUNK_ROWS rows at a time.
+
+    Each chunk is its own short read, so memory stays flat however many rows
+    there are, and the CSV header goes out before the first query runs.
+    """
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue()
+    after = 0
+    while True:
+        rows = await run_io("db", local_store.export_chunk, table, after, EXPORT_CHUNK_ROWS, **filters)
+        if not rows:
+            return
+        after = rows[-1]["export_rowid"]
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([row[column] for column in columns] for row in rows)
+            yield buffer.getvalue()
+        else:
+            yield "".join(json.dumps({column: row[column] for column in columns}, default=str) + "\n" for row in rows)
+
+def export_response(table: str, columns: List[str], export_format: str, **filters) -> StreamingResponse:
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    filename = f"{table}-{datetime.date.today().isoformat()}.{export_format}"
+    return StreamingResponse(
+        export_rows(table, columns, export_format, **filters),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/admin/export/moves")
+async def export_moves(
+    export_format: str = Query("csv", alias="format"),
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+    credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
+):
+    return export_response("moves", ["id", *MOVE_COLUMNS], export_format, date_from=date_from, date_to=date_to)
+
+@app.get("/admin/export/drivers")
+async def export_drivers(
+    export_format: str = Query("csv", alias="format"),
+    credentials: HTTPBasicCredentials = Depends(get_admin_credentials)
+):
+    return export_response("drivers", [column for column in DRIVER_COLUMNS if column != "password"], export_format)
+
+@app.get("/admin/outbox")
+async def get_outbox_status(credentials: HTTPBasicCredentials = Depends(get_admin_credentials)):
+    try:
+        return {"status": "success", "outbox": await run_io("db", email_outbox.stats)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/sync")
+async def get_sync_status(credentials: HTTPBasicCredentials = Depends(get_admin_credentials)):
+    try:
+        return {"status": "success", "sync": await run_io("db", sheet_sync.status)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/distance-cache")
+async def get_distance_cache_stats(credentials: HTTPBasicCredentials = Depends(get_admin_credentials)):
+    return {"status": "success", "distance_cache": distance_cache.stats()}
+
+@app.get("/ready")
+async def readiness():
+    """Ready once Sheets is connected and the local store has had its first full pull."""
+    if not sheet_sync.ready:
+        return JSONResponse(status_code=503, content={"status": "starting", "error": sheet_sync.last_error})
+    return {"status": "ready"}
+
 @app.get("/test-distance")
 async def test_distance():
+    if breakers["maps"].state == "open":
+        raise UpstreamUnavailable("maps", breakers["maps"].retry_after())
     try:
-        response = requests.get(DISTANCE_MATRIX_URL, params={
+        response = await run_io("maps", requests.get, DISTANCE_MATRIX_URL, params={
             "origins": "521 Red Drew Ave, Tuscaloosa, AL 35401",
             "destinations": "92 Springbrook Cir, Tuscaloosa, AL 35405",
             "key": GOOGLE_MAPS_API_KEY,
             "units": "imperial"
-        })
+        }, timeout=DISTANCE_TIMEOUT)
         data = response.json()
         pprint.pprint(data)
         return data
     except Exception as e:
-        return {"error": str(e)}
+        return {"error": describe_error(e)}
 
 
 # CORS setup
@@ -311,114 +2108,829 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class SubmitSizeLimit:
+    """Turn away oversized /submit bodies: up front from Content-Length, or mid-stream for chunked uploads."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/submit":
+            return await self.app(scope, receive, send)
+        limit = MAX_UPLOAD_TOTAL_BYTES + 1024 * 1024
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            return await JSONResponse(status_code=413, content={"detail": "Upload too large."})(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised while the form is being parsed, so it becomes a 413 before more is spooled to disk
+                    raise HTTPException(status_code=413, detail="Upload too large.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(SubmitSizeLimit)
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    spans: List[Tuple[str, str, float]] = []
+    token = request_spans.set(spans)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_spans.reset(token)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    metrics.observe(
+        "pikup_http_request_duration_seconds",
+        {"route": route.path if route else "unmatched", "method": request.method},
+        elapsed,
+    )
+    totals: Dict[str, float] = {}
+    for upstream, _, duration in spans:
+        totals[upstream] = totals.get(upstream, 0.0) + duration
+    response.headers["Server-Timing"] = ", ".join(
+        [f"{upstream};dur={duration * 1000:.1f}" for upstream, duration in totals.items()]
+        + [f"total;dur={elapsed * 1000:.1f}"]
+    )
+    return response
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable(request: Request, exc: UpstreamUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"status": "degraded", "upstream": exc.upstream, "detail": str(exc), "retry_after": round(exc.retry_after)},
+        headers={"Retry-After": str(max(int(exc.retry_after), 1))},
+    )
+
+@app.get("/health")
+async def get_health():
+    """Breaker state per upstream. Always 200: this worker is up even when an upstream isn't."""
+    upstreams = {name: breaker.status() for name, breaker in breakers.items()}
+    degraded = [name for name, upstream in upstreams.items() if upstream["state"] != "closed"]
+    return {"status": "degraded" if degraded else "ok", "degraded": degraded, "upstreams": upstreams}
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Environment Variables
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
-# Google Credentials
-from google.oauth2.service_account import Credentials
-import os
+# Google Sheets
+# Nothing here runs at import time. SheetSync.run() calls bootstrap_sheets()
+# from the app lifespan and keeps retrying until Sheets is reachable; request
+# handlers only use the local store, so they work before it succeeds.
+GOOGLE_CREDENTIALS_FILE = "google-credentials.json"
 
-# Load credentials from file
-creds = Credentials.from_service_account_file(
-    "google-credentials.json",
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
+gc = None
+worksheet = None
+drivers_sheet = None
 
-gc = gspread.authorize(creds)
-worksheet = gc.open_by_key(GOOGLE_SHEET_ID).sheet1
+DRIVERS_HEADERS = [
+    "Timestamp", "Name", "Email", "Phone", "Vehicle Type", "License Number", "Address",
+    "Notes", "Status", "Total Earnings", "Completed Moves", "Rating", "Password",
+]
+DRIVERS_COLUMN_WIDTHS = [180, 150, 200, 120, 150, 150, 250, 300, 100, 120, 120, 100, 150]
 
-# Create Drivers worksheet if it doesn't exist
-try:
-    drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet("Drivers")
-except gspread.exceptions.WorksheetNotFound:
-    # Create new worksheet
-    drivers_sheet = gc.open_by_key(GOOGLE_SHEET_ID).add_worksheet(
-        title="Drivers",
-        rows=1000,
-        cols=20
-    )
-    # Add headers
-    headers = [
-        "Timestamp",
-        "Name",
-        "Email",
-        "Phone",
-        "Vehicle Type",
-        "License Number",
-        "Address",
-        "Notes",
-        "Status",
-        "Total Earnings",
-        "Completed Moves",
-        "Rating"
+def drivers_sheet_requests(sheet_id: int) -> List[Dict]:
+    """Requests that create and format the Drivers tab in a single batch_update."""
+    def columns(start: int, end: int, first_row: int = 1) -> Dict:
+        return {"sheetId": sheet_id, "startRowIndex": first_row, "endRowIndex": 1000,
+                "startColumnIndex": start, "endColumnIndex": end}
+
+    def one_of(start: int, values: List[str]) -> Dict:
+        return {"setDataValidation": {"range": columns(start, start + 1), "rule": {
+            "condition": {"type": "ONE_OF_LIST", "values": [{"userEnteredValue": value} for value in values]},
+            "showCustomUi": True,
+            "strict": True
+        }}}
+
+    def number_format(start: int, number_type: str, pattern: str) -> Dict:
+        return {"repeatCell": {
+            "range": columns(start, start + 1),
+            "cell": {"userEnteredFormat": {"numberFormat": {"type": number_type, "pattern": pattern}}},
+            "fields": "userEnteredFormat.numberFormat"
+        }}
+
+    return [
+        {"addSheet": {"properties": {
+            "sheetId": sheet_id,
+            "title": "Drivers",
+            "gridProperties": {"rowCount": 1000, "columnCount": 20, "frozenRowCount": 1}
+        }}},
+        # Header row, bold on grey and centered
+        {"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+            "rows": [{"values": [{
+                "userEnteredValue": {"stringValue": header},
+                "userEnteredFormat": {
+                    "textFormat": {"bold": True},
+                    "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9},
+                    "horizontalAlignment": "CENTER"
+                }
+            } for header in DRIVERS_HEADERS]}],
+            "fields": "userEnteredValue,userEnteredFormat"
+        }},
+        *[
+            {"updateDimensionProperties": {
+                "range": {"sheetId": sheet_id, "dimension": "COLUMNS", "startIndex": index, "endIndex": index + 1},
+                "properties": {"pixelSize": width},
+                "fields": "pixelSize"
+            }}
+            for index, width in enumerate(DRIVERS_COLUMN_WIDTHS)
+        ],
+        one_of(8, ["Active", "Inactive", "On Leave", "Suspended"]),  # Status
+        one_of(4, ["Pickup Truck", "Van", "Box Truck", "Moving Truck"]),  # Vehicle Type
+        {"addConditionalFormatRule": {"rule": {
+            "ranges": [columns(8, 9)],
+            "booleanRule": {
+                "condition": {"type": "TEXT_EQ", "values": [{"userEnteredValue": "Inactive"}]},
+                "format": {"backgroundColor": {"red": 1.0, "green": 0.8, "blue": 0.8}}
+            }
+        }}},
+        number_format(9, "CURRENCY", "$#,##0.00"),  # Total Earnings
+        number_format(10, "NUMBER", "#,##0"),  # Completed Moves
+        number_format(11, "NUMBER", "0.0"),  # Rating
     ]
-    drivers_sheet.append_row(headers)
-    
-    # Format headers
-    drivers_sheet.format("A1:L1", {
-        "textFormat": {"bold": True},
-        "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9},
-        "horizontalAlignment": "CENTER"
-    })
-    
-    # Set column widths
-    drivers_sheet.set_column_width(1, 180)  # Timestamp
-    drivers_sheet.set_column_width(2, 150)  # Name
-    drivers_sheet.set_column_width(3, 200)  # Email
-    drivers_sheet.set_column_width(4, 120)  # Phone
-    drivers_sheet.set_column_width(5, 150)  # Vehicle Type
-    drivers_sheet.set_column_width(6, 150)  # License Number
-    drivers_sheet.set_column_width(7, 250)  # Address
-    drivers_sheet.set_column_width(8, 300)  # Notes
-    drivers_sheet.set_column_width(9, 100)  # Status
-    drivers_sheet.set_column_width(10, 120)  # Total Earnings
-    drivers_sheet.set_column_width(11, 120)  # Completed Moves
-    drivers_sheet.set_column_width(12, 100)  # Rating
-    
-    # Add data validation for Status column
-    status_rule = {
-        "condition": {
-            "type": "ONE_OF_LIST",
-            "values": ["Active", "Inactive", "On Leave", "Suspended"]
-        },
-        "showCustomUi": True,
-        "strict": True
-    }
-    drivers_sheet.set_data_validation(9, 9, 1000, 9, status_rule)
-    
-    # Add data validation for Vehicle Type column
-    vehicle_rule = {
-        "condition": {
-            "type": "ONE_OF_LIST",
-            "values": ["Pickup Truck", "Van", "Box Truck", "Moving Truck"]
-        },
-        "showCustomUi": True,
-        "strict": True
-    }
-    drivers_sheet.set_data_validation(5, 5, 1000, 5, vehicle_rule)
-    
-    # Add conditional formatting for Status
-    status_format = {
-        "ranges": [{"sheetId": drivers_sheet.id, "startRowIndex": 1, "endRowIndex": 1000, "startColumnIndex": 8, "endColumnIndex": 9}],
-        "booleanRule": {
-            "condition": {"type": "TEXT_EQ", "values": [{"userEnteredValue": "Inactive"}]},
-            "format": {"backgroundColor": {"red": 1.0, "green": 0.8, "blue": 0.8}}
+
+def move_header_requests(moves_sheet) -> List[Dict]:
+    """updateCells requests labelling sheet1's blank header cells."""
+    values = moves_sheet.batch_get([f"A1:{rowcol_to_a1(1, len(MOVE_HEADERS))}"])[0]
+    header = values[0] if values else []
+    return [
+        {"updateCells": {
+            "start": {"sheetId": moves_sheet.id, "rowIndex": 0, "columnIndex": column},
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": label}}]}],
+            "fields": "userEnteredValue",
+        }}
+        for column, label in enumerate(MOVE_HEADERS)
+        if column >= len(header) or not str(header[column]).strip()
+    ]
+
+def bootstrap_sheets():
+    """Authorize, open the spreadsheet, create the Drivers tab if it's missing and label sheet1's columns."""
+    global gc, worksheet, drivers_sheet
+    creds = Credentials.from_service_account_file(
+        GOOGLE_CREDENTIALS_FILE,
+        scopes=[
+            "https://www.googleapis.com/auth/spreadsheets",
+            "https://www.googleapis.com/auth/drive.metadata.readonly",  # modifiedTime, to skip unchanged pulls
+        ]
+    )
+    client = gspread.authorize(creds, http_client=ScheduledHTTPClient)
+    spreadsheet = client.open_by_key(GOOGLE_SHEET_ID)
+    sheets = spreadsheet.worksheets()
+    header_requests = move_header_requests(sheets[0])
+    if not any(sheet.title == "Drivers" for sheet in sheets):
+        # Every worker gets here on a fresh spreadsheet; the lock lets exactly
+        # one of them provision while the others wait and then reuse the tab
+        with open(f"{PIKUP_DB_PATH}.bootstrap.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            sheets = spreadsheet.worksheets()
+            if not any(sheet.title == "Drivers" for sheet in sheets):
+                reply = spreadsheet.batch_update({
+                    "requests": drivers_sheet_requests(random.randint(1, 2**31 - 1)) + header_requests
+                })
+                properties = reply["replies"][0]["addSheet"]["properties"]
+                sheets.append(gspread.Worksheet(spreadsheet, properties, spreadsheet.id, spreadsheet.client))
+                header_requests = []
+    if header_requests:
+        spreadsheet.batch_update({"requests": header_requests})
+    gc = client
+    worksheet = sheets[0]
+    drivers_sheet = next(sheet for sheet in sheets if sheet.title == "Drivers")
+
+DISTANCE_MATRIX_URL = os.getenv("DISTANCE_MATRIX_URL", "https://maps.googleapis.com/maps/api/distancematrix/json")
+
+# Sheet Sync
+SHEETS_PULL_INTERVAL = float(os.getenv("SHEETS_PULL_INTERVAL", "60"))  # Seconds
+SHEETS_PUSH_WINDOW = float(os.getenv("SHEETS_PUSH_WINDOW", "0.5"))  # Seconds
+SHEETS_RETRY_DELAY = 10  # Seconds
+SYNC_WAKE_POLL = 0.25  # Seconds between checks for writes made by other workers
+SHEETS_FULL_PULL_EVERY = int(os.getenv("SHEETS_FULL_PULL_EVERY", "10"))  # Pulls between full reconciliations
+
+class SheetSnapshot:
+    """A sheet's rows as of the last pull, as key -> (sheet row, content hash).
+
+    diff() compares a fresh read against it, so only rows that were added,
+    edited or moved reach the local store.
+    """
+
+    def __init__(self):
+        self.headers: Optional[List] = None
+        self.rows: Dict[str, Tuple[int, str]] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self.headers is not None
+
+    def diff(self, rows: List[List], key_index: int) -> Tuple[List[Tuple[int, List]], List[str], Dict]:
+        """(changed rows as (sheet row, values), keys no longer in the sheet, the new state to keep)."""
+        current = {}
+        changed = []
+        for sheet_row, values in enumerate(rows, start=2):
+            key = str(values[key_index]) if len(values) > key_index else ""
+            if not key or key in current:
+                continue
+            digest = hashlib.sha1(json.dumps(values, default=str).encode()).hexdigest()
+            current[key] = (sheet_row, digest)
+            if self.rows.get(key) != (sheet_row, digest):
+                changed.append((sheet_row, values))
+        removed = [key for key in self.rows if key not in current]
+        return changed, removed, current
+
+class SheetSync:
+    """Background mirror between the local store and Google Sheets.
+
+    A local write wakes the mirror, which waits SHEETS_PUSH_WINDOW so a burst
+    goes out together: new rows with one append_rows() per sheet, edited cells
+    with one batch_update(). Every SHEETS_PULL_INTERVAL both sheets are read
+    back so edits made by ops reach the local store. A sheet is also re-read
+    before its edited cells are pushed, so the row numbers used are current.
+
+    With several workers only the coordination leader runs the mirror; the
+    others wake it through the shared "sync_wake" counter.
+    """
+
+    def __init__(self):
+        self.driver_headers: List[str] = []
+        self.driver_columns: Dict[str, int] = {}  # header -> 1-indexed column
+        self.last_pull = 0.0
+        self.last_sync: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self._pulled = False
+        self._pulls_seen = 0
+        self.moves_snapshot = SheetSnapshot()
+        self.drivers_snapshot = SheetSnapshot()
+        self.pulls = 0
+        self.skipped_pulls = 0
+        self.probe_modified = True
+        self.last_modified: Optional[str] = None
+        self._wakes_seen = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def ready(self) -> bool:
+        """True once a pull has completed since this worker started, in this worker or the leader."""
+        return self._pulled or coordination.generation("sheets_pulled") > self._pulls_seen
+
+    def wake(self):
+        """Safe to call from any thread."""
+        if coordination.leader and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        else:
+            coordination.bump("sync_wake")
+
+    async def _wait_for_wake(self, timeout: float) -> bool:
+        """Wait up to `timeout` for a local wake() or one from another worker."""
+        deadline = time.monotonic() + timeout
+        while True:
+            wakes = coordination.generation("sync_wake")
+            if wakes != self._wakes_seen:
+                self._wakes_seen = wakes
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(remaining, SYNC_WAKE_POLL))
+                return True
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def _first_row(response) -> Optional[int]:
+        match = re.search(r"![A-Z]+(\d+)", response.get("updates", {}).get("updatedRange", ""))
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _rows_in_place(sheet, rows: List[sqlite3.Row], key_column: int, key_field: str) -> bool:
+        """Check with one batch read that each row still holds the record we think it does."""
+        if not rows:
+            return True
+        found = sheet.batch_get(
+            [rowcol_to_a1(row["sheet_row"], key_column) for row in rows],
+            value_render_option=ValueRenderOption.unformatted,
+        )
+        return all(
+            (values[0][0] if values and values[0] else "") == row[key_field]
+            for values, row in zip(found, rows)
+        )
+
+    def sheets_changed(self) -> bool:
+        """Whether the spreadsheet was modified since the last probe, going by its Drive modifiedTime.
+
+        Every SHEETS_FULL_PULL_EVERY pulls the snapshots are dropped, so that
+        pull reconciles whole sheets whatever the probe says.
+        """
+        self.pulls += 1
+        if (self.pulls - 1) % SHEETS_FULL_PULL_EVERY == 0:
+            self.moves_snapshot = SheetSnapshot()
+            self.drivers_snapshot = SheetSnapshot()
+        if not self.probe_modified:
+            return True
+        try:
+            modified = worksheet.spreadsheet.get_lastUpdateTime()
+        except gspread.exceptions.APIError as e:
+            print(f"Can't read the spreadsheet's modifiedTime, pulling every time: {str(e)}")
+            self.probe_modified = False
+            return True
+        unchanged = modified == self.last_modified and self.moves_snapshot.loaded and self.drivers_snapshot.loaded
+        self.last_modified = modified
+        if unchanged:
+            self.skipped_pulls += 1
+        return not unchanged
+
+    def pull_moves(self):
+        values = worksheet.get_all_values(value_render_option=ValueRenderOption.unformatted)
+        headers, rows = (values[0], values[1:]) if values else ([], [])
+        snapshot = self.moves_snapshot
+        changed, removed, state = snapshot.diff(rows, 0)
+        if not snapshot.loaded or headers != snapshot.headers:
+            local_store.merge_moves(list(enumerate(rows, start=2)))
+        elif changed or removed:
+            local_store.merge_moves(changed, removed)
+        snapshot.headers, snapshot.rows = headers, state
+
+    def pull_drivers(self):
+        values = drivers_sheet.get_all_values(value_render_option=ValueRenderOption.unformatted)
+        headers, rows = (values[0], values[1:]) if values else ([], [])
+        self.driver_headers = [normalize_header(header) for header in headers]
+        self.driver_columns = {header: index for index, header in enumerate(self.driver_headers, start=1)}
+        snapshot = self.drivers_snapshot
+        if "email" not in self.driver_columns:
+            merged = local_store.merge_drivers(headers, list(enumerate(rows, start=2)))
+            snapshot.headers, snapshot.rows = None, {}
+        else:
+            changed, removed, state = snapshot.diff(rows, self.driver_columns["email"] - 1)
+            if not snapshot.loaded or headers != snapshot.headers:
+                merged = local_store.merge_drivers(headers, list(enumerate(rows, start=2)))
+            elif changed or removed:
+                merged = local_store.merge_drivers(headers, changed, removed)
+            else:
+                merged = False
+            snapshot.headers, snapshot.rows = headers, state
+        if merged:
+            coordination.bump("drivers")
+
+    def push_moves(self):
+        new = local_store.unsynced("moves")
+        if new:
+            response = worksheet.append_rows(
+                [[row[column] for column in MOVE_COLUMNS] for row in new], table_range="A1"
+            )
+            first_row = self._first_row(response)
+            if first_row is None:
+                # Can't tell where they landed; re-reading matches them by timestamp
+                self.pull_moves()
+            else:
+                local_store.mark_synced("moves", "id", [
+                    (row["id"], row["version"], first_row + offset) for offset, row in enumerate(new)
+                ])
+        dirty = local_store.dirty("moves")
+        if not self._rows_in_place(worksheet, dirty, 1, "timestamp"):
+            # Rows were moved in the sheet; re-read to get their current positions
+            self.pull_moves()
+            dirty = local_store.dirty("moves")
+        if dirty:
+            worksheet.batch_update([
+                {"range": rowcol_to_a1(row["sheet_row"], MOVE_COLUMNS.index(field) + 1), "values": [[row[field]]]}
+                for row in dirty for field in json.loads(row["dirty_fields"])
+            ])
+            local_store.mark_synced("moves", "id", [(row["id"], row["version"], row["sheet_row"]) for row in dirty])
+
+    def push_drivers(self):
+        deleted = local_store.deleted_drivers()
+        dirty = local_store.dirty("drivers")
+        if not self._rows_in_place(drivers_sheet, deleted + dirty, self.driver_columns["email"], "email"):
+            self.pull_drivers()
+            deleted = local_store.deleted_drivers()
+        headers = self.driver_headers
+        if deleted:
+            drivers_sheet.spreadsheet.batch_update({"requests": [
+                {"deleteDimension": {"range": {
+                    "sheetId": drivers_sheet.id,
+                    "dimension": "ROWS",
+                    "startIndex": row["sheet_row"] - 1,
+                    "endIndex": row["sheet_row"],
+                }}}
+                for row in deleted
+            ]})
+            local_store.purge_drivers(deleted)
+        # Drain every new driver this pass; nothing would wake us for a leftover batch
+        while True:
+            new = local_store.unsynced("drivers")
+            if not new:
+                break
+            response = drivers_sheet.append_rows(
+                [[row[header] if header in DRIVER_COLUMNS else "" for header in headers] for row in new],
+                table_range="A1",
+            )
+            first_row = self._first_row(response)
+            if first_row is None:
+                self.pull_drivers()
+                break
+            local_store.mark_synced("drivers", "email", [
+                (row["email"], row["version"], first_row + offset) for offset, row in enumerate(new)
+            ])
+        dirty = local_store.dirty("drivers")
+        if dirty:
+            data = [
+                {"range": rowcol_to_a1(row["sheet_row"], self.driver_columns[field]), "values": [[row[field]]]}
+                for row in dirty for field in json.loads(row["dirty_fields"]) if field in self.driver_columns
+            ]
+            if data:
+                drivers_sheet.batch_update(data)
+            local_store.mark_synced("drivers", "email", [(row["email"], row["version"], row["sheet_row"]) for row in dirty])
+
+    def sync_once(self, pull: bool = False):
+        changed = pull and self.sheets_changed()
+        if changed:
+            self.pull_moves()
+        self.push_moves()
+        if changed or "email" not in self.driver_columns:
+            self.pull_drivers()
+        totals = local_store.stale_driver_totals()
+        if totals:
+            # Keep the Drivers tab's earnings columns in step with the aggregates
+            drivers_repo.update_many(totals)
+        self.push_drivers()
+        if pull:
+            self.last_pull = time.monotonic()
+        self.last_sync = datetime.datetime.now().isoformat()
+
+    def status(self) -> Dict:
+        with closing(db_connect()) as conn:
+            pending_moves = conn.execute(
+                "SELECT COUNT(*) FROM moves WHERE sheet_row IS NULL OR dirty_fields IS NOT NULL"
+            ).fetchone()[0]
+            pending_drivers = conn.execute(
+                "SELECT COUNT(*) FROM drivers WHERE sheet_row IS NULL OR dirty_fields IS NOT NULL OR deleted = 1"
+            ).fetchone()[0]
+        return {
+            "pending_moves": pending_moves,
+            "pending_drivers": pending_drivers,
+            "ready": self.ready,
+            "leader": coordination.leader,
+            "pulls": self.pulls,
+            "skipped_pulls": self.skipped_pulls,
+            "worker_pid": os.getpid(),
+            "last_sync": self.last_sync,
+            "last_error": self.last_error,
+            "scheduler": sheets_scheduler.stats(),
         }
-    }
-    drivers_sheet.spreadsheet.batch_update({"requests": [{"addConditionalFormatRule": {"rule": status_format}}]})
-    
-    # Add number formatting for earnings and moves
-    drivers_sheet.format("J2:J1000", {"numberFormat": {"type": "CURRENCY", "pattern": "$#,##0.00"}})
-    drivers_sheet.format("K2:K1000", {"numberFormat": {"type": "NUMBER", "pattern": "#,##0"}})
-    drivers_sheet.format("L2:L1000", {"numberFormat": {"type": "NUMBER", "pattern": "0.0"}})
-    
-    # Freeze header row
-    drivers_sheet.freeze(rows=1)
 
-DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+    async def connect(self):
+        delay = 1
+        while True:
+            try:
+                await run_io("sheets", bootstrap_sheets)
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Connecting to Google Sheets failed, retrying in {delay}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._pulls_seen = coordination.generation("sheets_pulled")
+        while not coordination.try_lead():
+            # Another worker mirrors the sheets; take over if it goes away
+            await asyncio.sleep(SHEETS_RETRY_DELAY)
+        print(f"Worker {os.getpid()} is syncing Google Sheets")
+        self._wakes_seen = coordination.generation("sync_wake")
+        await self.connect()
+        while True:
+            pull = time.monotonic() - self.last_pull >= SHEETS_PULL_INTERVAL
+            try:
+                await run_io("sheets", self.sync_once, pull)
+                self.last_error = None
+                if pull:
+                    self._pulled = True
+                    coordination.bump("sheets_pulled")
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Sheet sync failed: {str(e)}")
+            next_pull = SHEETS_PULL_INTERVAL - (time.monotonic() - self.last_pull)
+            timeout = SHEETS_RETRY_DELAY if self.last_error else max(next_pull, 0)
+            if await self._wait_for_wake(timeout):
+                await asyncio.sleep(SHEETS_PUSH_WINDOW)
+            self._wakeup.clear()
+
+sheet_sync = SheetSync()
+
+# Distance Cache
+DISTANCE_CACHE_TTL = int(os.getenv("DISTANCE_CACHE_TTL", str(30 * 24 * 3600)))  # Seconds
+DISTANCE_CACHE_SIZE = int(os.getenv("DISTANCE_CACHE_SIZE", "5000"))  # In-memory entries
+DISTANCE_BUDGET = float(os.getenv("DISTANCE_BUDGET", "1.5"))  # Seconds to wait for Distance Matrix before estimating
+DISTANCE_TIMEOUT = float(os.getenv("DISTANCE_TIMEOUT", "10"))  # Hard limit on one Maps request
+DISTANCE_ROAD_FACTOR = float(os.getenv("DISTANCE_ROAD_FACTOR", "1.3"))  # Driving miles per great-circle mile
+GEOCODE_URL = os.getenv("GEOCODE_URL", "https://maps.googleapis.com/maps/api/geocode/json")
+EARTH_RADIUS_MILES = 3958.8
+
+ADDRESS_ABBREVIATIONS = {
+    "street": "st", "avenue": "ave", "road": "rd", "drive": "dr", "boulevard": "blvd",
+    "lane": "ln", "court": "ct", "circle": "cir", "place": "pl", "parkway": "pkwy",
+    "highway": "hwy", "apartment": "apt", "suite": "ste", "north": "n", "south": "s",
+    "east": "e", "west": "w", "alabama": "al",
+}
+
+def normalize_address(address: str) -> str:
+    words = re.sub(r"[^a-z0-9]+", " ", address.lower()).split()
+    return " ".join(ADDRESS_ABBREVIATIONS.get(word, word) for word in words)
+
+class DistanceCache:
+    """Driving distances keyed by normalized (origin, destination).
+
+    Lookups hit an in-memory LRU first and the distance_cache table second;
+    entries older than the TTL are treated as misses in both tiers.
+    """
+
+    def __init__(self, max_entries: int = DISTANCE_CACHE_SIZE, ttl: int = DISTANCE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: OrderedDict = OrderedDict()  # key -> (miles, stored_at)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        with closing(db_connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS distance_cache (
+                    origin TEXT NOT NULL,
+                    destination TEXT NOT NULL,
+                    miles REAL NOT NULL,
+                    stored_at REAL NOT NULL,
+                    PRIMARY KEY (origin, destination)
+                )
+            """)
+
+    @staticmethod
+    def key(origin: str, destination: str) -> Tuple[str, str]:
+        return normalize_address(origin), normalize_address(destination)
+
+    def _remember(self, key: Tuple[str, str], miles: float, stored_at: float):
+        self._memory[key] = (miles, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0]
+
+    def get_stored(self, key: Tuple[str, str]) -> Optional[float]:
+        with closing(db_connect()) as conn:
+            row = conn.execute(
+                "SELECT miles, stored_at FROM distance_cache WHERE origin = ? AND destination = ? AND stored_at > ?",
+                (key[0], key[1], time.time() - self.ttl),
+            ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row["miles"], row["stored_at"])
+            return row["miles"]
+
+    def put(self, key: Tuple[str, str], miles: float):
+        now = time.time()
+        with closing(db_connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO distance_cache (origin, destination, miles, stored_at) VALUES (?, ?, ?, ?)",
+                (key[0], key[1], miles, now),
+            )
+        with self._lock:
+            self._remember(key, miles, now)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else None,
+                "ttl_seconds": self.ttl,
+            }
+
+distance_cache = DistanceCache()
+
+def fetch_distance_miles(origin: str, destination: str) -> Optional[float]:
+    """Ask the Distance Matrix API for the driving distance; None if it has no answer."""
+    with breakers["maps"].guard(), metrics.timer("maps", "distance_matrix"):
+        response = requests.get(DISTANCE_MATRIX_URL, params={
+            "origins": origin,
+            "destinations": destination,
+            "key": GOOGLE_MAPS_API_KEY,
+            "units": "imperial"
+        }, timeout=DISTANCE_TIMEOUT)
+        if response.status_code >= 500:
+            response.raise_for_status()
+    if response.status_code != 200:
+        print(f"Distance API error: {response.status_code}")
+        return None
+    rows = response.json().get("rows")
+    if not rows:
+        print("No valid rows returned from Distance Matrix API.")
+        return None
+    elements = rows[0].get("elements")
+    if not elements or elements[0].get("status") != "OK":
+        print("No valid elements returned from Distance Matrix API.")
+        return None
+    return round(elements[0]["distance"]["value"] / 1609.34, 2)
+
+class GeocodeCache:
+    """Coordinates of addresses we've geocoded, keyed by normalized address.
+
+    Filled in the background whenever a distance isn't cached, so estimates
+    and dispatch have coordinates when Distance Matrix is slow or down.
+    Entries don't expire.
+    """
+
+    def __init__(self, max_entries: int = DISTANCE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._memory: OrderedDict = OrderedDict()  # address -> (lat, lng)
+        self._lock = threading.Lock()
+        with closing(db_connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocode_cache (
+                    address TEXT PRIMARY KEY,
+                    lat REAL NOT NULL,
+                    lng REAL NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+
+    def _remember(self, address: str, coordinates: Tuple[float, float]):
+        self._memory[address] = coordinates
+        self._memory.move_to_end(address)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, address: str) -> Optional[Tuple[float, float]]:
+        address = normalize_address(address)
+        with self._lock:
+            if address in self._memory:
+                self._memory.move_to_end(address)
+                return self._memory[address]
+        with closing(db_connect()) as conn:
+            row = conn.execute("SELECT lat, lng FROM geocode_cache WHERE address = ?", (address,)).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            self._remember(address, (row["lat"], row["lng"]))
+        return row["lat"], row["lng"]
+
+    def put(self, address: str, coordinates: Tuple[float, float]):
+        address = normalize_address(address)
+        with closing(db_connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (address, lat, lng, stored_at) VALUES (?, ?, ?, ?)",
+                (address, coordinates[0], coordinates[1], time.time()),
+            )
+        with self._lock:
+            self._remember(address, coordinates)
+
+geocode_cache = GeocodeCache()
+
+def parse_coordinates(lat, lng) -> Optional[Tuple[float, float]]:
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+def haversine_miles(start: Tuple[float, float], end: Tuple[float, float]) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (*start, *end))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+def fetch_geocode(address: str) -> Optional[Tuple[float, float]]:
+    with breakers["geocode"].guard(), metrics.timer("maps", "geocode"):
+        response = requests.get(GEOCODE_URL, params={"address": address, "key": GOOGLE_MAPS_API_KEY}, timeout=DISTANCE_TIMEOUT)
+        if response.status_code >= 500:
+            response.raise_for_status()
+    results = response.json().get("results") if response.status_code == 200 else None
+    if not results:
+        print(f"Geocoding returned no results (HTTP {response.status_code})")
+        return None
+    location = results[0]["geometry"]["location"]
+    return location["lat"], location["lng"]
+
+# Lookups that outlive the request that started them
+maps_lookups: set = set()
+geocode_lookups: Dict[str, asyncio.Task] = {}  # Normalized address -> geocode in flight
+
+def in_background(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    maps_lookups.add(task)
+    task.add_done_callback(maps_lookups.discard)
+    return task
+
+async def lookup_distance(origin: str, destination: str, key: Tuple[str, str]) -> Optional[float]:
+    """Ask Distance Matrix and cache the answer, even if the caller stopped waiting for it."""
+    try:
+        miles = await run_io("maps", fetch_distance_miles, origin, destination)
+        if miles is not None:
+            await run_io("db", distance_cache.put, key, miles)
+        return miles
+    except Exception as e:
+        print(f"Distance lookup failed: {describe_error(e)}")
+        return None
+
+async def geocode(address: str) -> Optional[Tuple[float, float]]:
+    """Geocode and cache one address; None if Maps can't say where it is right now."""
+    try:
+        coordinates = await run_io("maps", fetch_geocode, address)
+        if coordinates is not None:
+            await run_io("db", geocode_cache.put, address, coordinates)
+        return coordinates
+    except UpstreamUnavailable:
+        return None
+    except Exception as e:
+        print(f"Geocoding failed: {describe_error(e)}")
+        return None
+
+def geocode_in_background(address: str) -> asyncio.Task:
+    """Start geocoding an address, or join the lookup already running for it."""
+    key = normalize_address(address)
+    task = geocode_lookups.get(key)
+    if task is None:
+        task = in_background(geocode(address))
+        geocode_lookups[key] = task
+        task.add_done_callback(lambda _: geocode_lookups.pop(key, None))
+    return task
+
+async def warm_geocodes(addresses: List[str]):
+    """Geocode any of these addresses not cached yet, without waiting for the answers."""
+    for address in addresses:
+        if await run_io("db", geocode_cache.get, address) is None:
+            geocode_in_background(address)
+
+async def estimate_distance(origin: str, destination: str, origin_coordinates: Optional[Tuple[float, float]]) -> Optional[float]:
+    """Great-circle miles times DISTANCE_ROAD_FACTOR, or None if either end has no known coordinates."""
+    start = origin_coordinates or await run_io("db", geocode_cache.get, origin)
+    end = await run_io("db", geocode_cache.get, destination)
+    if start is None or end is None:
+        return None
+    return round(haversine_miles(start, end) * DISTANCE_ROAD_FACTOR, 2)
+
+async def get_distance_miles(
+    origin: str, destination: str, origin_coordinates: Optional[Tuple[float, float]] = None
+) -> Tuple[Optional[float], str]:
+    """Driving miles and where they came from: "cache", "distance_matrix", "estimate" or "unavailable".
+
+    Distance Matrix gets DISTANCE_BUDGET seconds. If it's slower than that or
+    fails, we answer with a straight-line estimate instead and let the lookup
+    finish in the background so the next request finds it cached. Every miss
+    also geocodes both addresses, so estimates keep working through an outage
+    for addresses seen before. Without coordinates for an estimate we keep
+    waiting, up to DISTANCE_TIMEOUT.
+    """
+    key = distance_cache.key(origin, destination)
+    miles = distance_cache.get_memory(key)
+    if miles is None:
+        miles = await run_io("db", distance_cache.get_stored, key)
+    if miles is not None:
+        return miles, "cache"
+
+    lookup = in_background(lookup_distance(origin, destination, key))
+    # Geocode both ends alongside, while Maps is answering, so a later outage can still be estimated
+    await warm_geocodes([destination] if origin_coordinates else [origin, destination])
+    try:
+        miles = await asyncio.wait_for(asyncio.shield(lookup), DISTANCE_BUDGET)
+    except asyncio.TimeoutError:
+        print(f"Distance Matrix took over {DISTANCE_BUDGET}s, estimating instead")
+    if miles is not None:
+        return miles, "distance_matrix"
+
+    estimate = await estimate_distance(origin, destination, origin_coordinates)
+    if estimate is not None:
+        return estimate, "estimate"
+    miles = await lookup
+    return (miles, "distance_matrix") if miles is not None else (None, "unavailable")
 
 # Pricing
 pricing_config = {
@@ -430,6 +2942,314 @@ pricing_config = {
 }
 
 STAIRS_SURCHARGE = 50  # Flat fee for stairs
+DRIVER_SHARE = 0.7  # Driver pay as a fraction of the price; the rest is business profit
+MAX_QUOTE_CANDIDATES = 200
+
+def item_volume_ft3(item: Dict) -> float:
+    return (item["length"] * item["width"] * item["height"]) / 1728
+
+def quote_moves(move_types: List[str], item_lists: List[List[Dict]], distance_miles: float, has_stairs: bool) -> List[Dict]:
+    """Price every move type against every item list.
+
+    Volumes and item counts are worked out once per item list and each
+    config's mileage charge once per move type, so a grid of candidates costs
+    one pass over the items. "total" is unrounded; the breakdown is rounded
+    for display.
+    """
+    lists = [(sum(item_volume_ft3(item) for item in items), len(items)) for items in item_lists]
+    stairs = STAIRS_SURCHARGE if has_stairs else 0
+    quotes = []
+    for move_type in move_types:
+        config = pricing_config.get(move_type, pricing_config["Home to Home"])
+        mileage = config["per_mile"] * distance_miles
+        for index, (total_ft3, item_count) in enumerate(lists):
+            breakdown = {
+                "base": config["base"],
+                "mileage": mileage,
+                "volume": config["per_ft3"] * total_ft3,
+                "items": config["per_item"] * item_count,
+                "stairs": stairs,
+            }
+            quotes.append({
+                "move_type": move_type,
+                "item_list": index,
+                "item_count": item_count,
+                "total_ft3": round(total_ft3, 2),
+                "breakdown": {charge: round(amount, 2) for charge, amount in breakdown.items()},
+                "total": sum(breakdown.values()),
+            })
+    return quotes
+
+def quote_move(move_type: str, items: List[Dict], distance_miles: float, has_stairs: bool) -> Dict:
+    return quote_moves([move_type], [items], distance_miles, has_stairs)[0]
+
+class QuoteItem(BaseModel):
+    item_name: str = ""
+    length: float
+    width: float
+    height: float
+
+class QuoteRequest(BaseModel):
+    move_type: Optional[str] = None
+    move_types: Optional[List[str]] = None
+    items: Optional[List[QuoteItem]] = None
+    item_lists: Optional[List[List[QuoteItem]]] = None
+    pickup_address: str = ""
+    destination_address: str = ""
+    current_lat: Optional[float] = None
+    current_lng: Optional[float] = None
+    mileage_override: Optional[float] = None
+    has_stairs: bool = False
+
+@app.post("/quote")
+async def get_quote(quote_request: QuoteRequest):
+    """Price one or more candidate moves without saving anything or sending email."""
+    move_types = quote_request.move_types or [quote_request.move_type or "Home to Home"]
+    item_lists = quote_request.item_lists or [quote_request.items or []]
+    if len(move_types) * len(item_lists) > MAX_QUOTE_CANDIDATES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_QUOTE_CANDIDATES} move type and item list combinations per request.")
+
+    distance_miles = 0
+    distance_source = "none"
+    if quote_request.mileage_override:
+        distance_miles = quote_request.mileage_override
+        distance_source = "override"
+    elif quote_request.pickup_address and quote_request.destination_address:
+        try:
+            distance_miles, distance_source = await get_distance_miles(
+                quote_request.pickup_address,
+                quote_request.destination_address,
+                parse_coordinates(quote_request.current_lat, quote_request.current_lng),
+            )
+            distance_miles = distance_miles or 0
+        except Exception as e:
+            print(f"Distance calculation failed: {describe_error(e)}")
+
+    quotes = quote_moves(
+        move_types,
+        [[item.model_dump() for item in items] for items in item_lists],
+        distance_miles,
+        quote_request.has_stairs,
+    )
+    for candidate in quotes:
+        total = candidate.pop("total")
+        candidate["estimated_price"] = round(total, 2)
+        candidate["driver_pay"] = round(total * DRIVER_SHARE, 2)
+    return {"status": "success", "distance_miles": distance_miles, "distance_source": distance_source, "quotes": quotes}
+
+# Dispatch
+# Drivers' apps report their position to /driver/location. Each worker keeps
+# those positions in a grid of DISPATCH_CELL_DEGREES cells, so finding the
+# nearest drivers to a pickup only looks at the cells around it. /submit
+# assigns the closest active driver whose vehicle fits the items and who
+# isn't already holding DISPATCH_MAX_OPEN_MOVES uncompleted moves.
+DISPATCH_ENABLED = os.getenv("DISPATCH_ENABLED", "1") != "0"
+DISPATCH_CELL_DEGREES = 0.05  # About 3.5 miles north-south
+DISPATCH_MAX_MILES = float(os.getenv("DISPATCH_MAX_MILES", "30"))
+DISPATCH_MAX_OPEN_MOVES = int(os.getenv("DISPATCH_MAX_OPEN_MOVES", "3"))
+DISPATCH_LOCATION_MAX_AGE = int(os.getenv("DISPATCH_LOCATION_MAX_AGE", str(12 * 3600)))  # Seconds
+DISPATCH_CANDIDATES = 5  # Nearest drivers checked for open moves per dispatch
+DISPATCH_GEOCODE_BUDGET = float(os.getenv("DISPATCH_GEOCODE_BUDGET", "1.0"))  # Seconds to wait for an uncached pickup
+# Keyed by the Vehicle Type choices on the Drivers tab, lowercased
+VEHICLE_CAPACITY_FT3 = {"pickup truck": 250, "van": 350, "box truck": 1200, "moving truck": 1700}
+DEFAULT_VEHICLE_CAPACITY_FT3 = 250
+
+class DispatchIndex:
+    """Last known driver positions, bucketed into a lat/lng grid.
+
+    Positions are stored in driver_locations so every worker sees them; each
+    report gets the next seq, and refresh() applies only rows newer than the
+    last one this worker has seen.
+    """
+
+    def __init__(self, cell_degrees: float = DISPATCH_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Tuple[int, int], Dict[str, Tuple[float, float, float]]] = {}
+        self._positions: Dict[str, Tuple[int, int]] = {}  # email -> cell
+        self._seq = 0
+        self._generation: Optional[int] = None
+        self._lock = threading.Lock()
+        with closing(db_connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS driver_locations (
+                    email TEXT PRIMARY KEY,
+                    lat REAL NOT NULL,
+                    lng REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    seq INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS driver_locations_seq ON driver_locations (seq)")
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees)
+
+    def report(self, email: str, coordinates: Tuple[float, float]):
+        with closing(db_connect()) as conn, conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO driver_locations (email, lat, lng, updated_at, seq)
+                VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM driver_locations))
+            """, (email, coordinates[0], coordinates[1], time.time()))
+        coordination.bump("locations")
+
+    def refresh(self):
+        """Apply positions reported (by any worker) since the last refresh."""
+        generation = coordination.generation("locations")
+        if generation == self._generation:
+            return
+        with closing(db_connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM driver_locations WHERE seq > ? ORDER BY seq", (self._seq,)
+            ).fetchall()
+        with self._lock:
+            for row in rows:
+                previous = self._positions.get(row["email"])
+                if previous is not None:
+                    self._cells[previous].pop(row["email"], None)
+                cell = self._cell(row["lat"], row["lng"])
+                self._cells.setdefault(cell, {})[row["email"]] = (row["lat"], row["lng"], row["updated_at"])
+                self._positions[row["email"]] = cell
+                self._seq = row["seq"]
+            self._generation = generation
+
+    def nearest(self, coordinates: Tuple[float, float], eligible, limit: int, max_miles: float) -> List[Tuple[float, str]]:
+        """Up to `limit` (miles, email) pairs for eligible drivers, nearest first, searching outward ring by ring."""
+        lat, lng = coordinates
+        center = self._cell(lat, lng)
+        # Cells are narrower east-west away from the equator, so bound rings by the smaller side
+        cell_miles = self.cell_degrees * 69.0 * max(math.cos(math.radians(min(abs(lat), 89))), 0.01)
+        oldest = time.time() - DISPATCH_LOCATION_MAX_AGE
+        found: List[Tuple[float, str]] = []
+        ring = 0
+        with self._lock:
+            while (ring - 1) * cell_miles <= max_miles:
+                cells = [
+                    (center[0] + di, center[1] + dj)
+                    for di in range(-ring, ring + 1) for dj in range(-ring, ring + 1)
+                    if max(abs(di), abs(dj)) == ring
+                ]
+                for cell in cells:
+                    for email, (driver_lat, driver_lng, updated_at) in self._cells.get(cell, {}).items():
+                        if updated_at < oldest or not eligible(email):
+                            continue
+                        miles = haversine_miles(coordinates, (driver_lat, driver_lng))
+                        if miles <= max_miles:
+                            found.append((miles, email))
+                found.sort()
+                # Anything in the next ring is at least ring * cell_miles away
+                if len(found) >= limit and found[limit - 1][0] <= ring * cell_miles:
+                    break
+                ring += 1
+        return found[:limit]
+
+    def pick(self, coordinates: Tuple[float, float], volume_ft3: float) -> Optional[Dict]:
+        """The nearest available driver whose vehicle holds `volume_ft3`, or None."""
+        self.refresh()
+
+        def eligible(email: str) -> bool:
+            driver = drivers_repo.get(email)
+            if driver is None or str(driver.get("status", "")).strip().lower() != "active":
+                return False
+            capacity = VEHICLE_CAPACITY_FT3.get(str(driver.get("vehicle_type", "")).strip().lower(), DEFAULT_VEHICLE_CAPACITY_FT3)
+            return capacity >= volume_ft3
+
+        candidates = self.nearest(coordinates, eligible, DISPATCH_CANDIDATES, DISPATCH_MAX_MILES)
+        if not candidates:
+            return None
+        with closing(db_connect()) as conn:
+            open_moves = {
+                row["driver_email"]: row["assigned_moves"] - row["completed_moves"]
+                for row in conn.execute(
+                    f"SELECT * FROM driver_stats WHERE driver_email IN ({', '.join('?' for _ in candidates)})",
+                    [email for _, email in candidates],
+                )
+            }
+        for miles, email in candidates:
+            if open_moves.get(email, 0) < DISPATCH_MAX_OPEN_MOVES:
+                return {"email": email, "name": drivers_repo.get(email)["name"], "miles": round(miles, 1)}
+        return None
+
+dispatch_index = DispatchIndex()
+
+async def dispatch_move(pickup_address: str, coordinates: Optional[Tuple[float, float]], items: List[Dict]) -> Optional[Dict]:
+    """Pick a driver for a new move, or None to leave it for manual assignment."""
+    if not DISPATCH_ENABLED:
+        return None
+    coordinates = coordinates or await run_io("db", geocode_cache.get, pickup_address)
+    if coordinates is None:
+        # Joins the geocode the distance lookup started; if it's slow it still finishes and is cached
+        try:
+            coordinates = await asyncio.wait_for(
+                asyncio.shield(geocode_in_background(pickup_address)), DISPATCH_GEOCODE_BUDGET
+            )
+        except asyncio.TimeoutError:
+            print(f"Geocoding the pickup took over {DISPATCH_GEOCODE_BUDGET}s, leaving the move unassigned")
+    if coordinates is None:
+        return None
+    volume = sum(item_volume_ft3(item) for item in items)
+    return await run_io("db", dispatch_index.pick, coordinates, volume)
+
+class DriverLocation(BaseModel):
+    lat: float
+    lng: float
+
+@app.post("/driver/location")
+async def report_driver_location(
+    location: DriverLocation,
+    credentials: Dict = Depends(get_driver_credentials)
+):
+    coordinates = parse_coordinates(location.lat, location.lng)
+    if coordinates is None:
+        raise HTTPException(status_code=400, detail="lat/lng out of range")
+    await run_io("db", dispatch_index.report, credentials["email"], coordinates)
+    return {"status": "success"}
+
+# Photo Uploads
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "20"))
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(15 * 1024 * 1024)))
+MAX_UPLOAD_TOTAL_BYTES = int(os.getenv("MAX_UPLOAD_TOTAL_BYTES", str(SMTP_MAX_ATTACHMENT_BYTES)))  # Fits one admin email
+UPLOAD_IMAGE_MAX_PX = int(os.getenv("UPLOAD_IMAGE_MAX_PX", "1600"))  # Longest side after downscaling
+UPLOAD_IMAGE_QUALITY = 80
+
+def upload_size(upload: UploadFile) -> int:
+    if upload.size is not None:
+        return upload.size
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    return size
+
+def check_upload_sizes(files: List[UploadFile]):
+    if len(files) > MAX_UPLOAD_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many photos, the limit is {MAX_UPLOAD_FILES}.")
+    total = 0
+    for file in files:
+        size = upload_size(file)
+        if size > MAX_UPLOAD_FILE_BYTES:
+            raise HTTPException(status_code=413, detail=f"{file.filename} is larger than {MAX_UPLOAD_FILE_BYTES // (1024 * 1024)} MB.")
+        total += size
+    if total > MAX_UPLOAD_TOTAL_BYTES:
+        raise HTTPException(status_code=413, detail=f"Photos add up to more than {MAX_UPLOAD_TOTAL_BYTES // (1024 * 1024)} MB.")
+
+def prepare_attachment(upload: UploadFile) -> Tuple[str, BinaryIO]:
+    """Downscale and recompress a photo if that makes it smaller; otherwise attach it as uploaded."""
+    upload.file.seek(0)
+    if Image is None:
+        return upload.filename, upload.file
+    try:
+        with Image.open(upload.file) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((UPLOAD_IMAGE_MAX_PX, UPLOAD_IMAGE_MAX_PX))
+            resized = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+            image.convert("RGB").save(resized, "JPEG", quality=UPLOAD_IMAGE_QUALITY, optimize=True)
+    except Exception:  # Not an image Pillow can read
+        upload.file.seek(0)
+        return upload.filename, upload.file
+    if resized.tell() >= upload_size(upload):
+        resized.close()
+        upload.file.seek(0)
+        return upload.filename, upload.file
+    return f"{os.path.splitext(upload.filename or 'photo')[0]}.jpg", resized
 
 @app.post("/submit")
 async def submit_move(
@@ -452,6 +3272,9 @@ async def submit_move(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Problem reading input: {str(e)}")
 
+    if files:
+        check_upload_sizes(files)
+
     # Extracting fields
     name = data_obj.get("name", "")
     email = data_obj.get("email", "")
@@ -470,6 +3293,7 @@ async def submit_move(
     scheduled_time = data_obj.get("scheduled_time", "")  # Format: HH:MM
 
     # Combine date and time as local time
+    scheduled_datetime = None
     try:
         scheduled_datetime = datetime.datetime.strptime(f"{scheduled_date} {scheduled_time}", "%Y-%m-%d %H:%M")
         formatted_date = scheduled_datetime.strftime("%B %d, %Y at %I:%M %p")
@@ -479,77 +3303,70 @@ async def submit_move(
 
     # Distance Calculation
     distance_miles = 0
-    distance_miles = 0
+    distance_source = "none"
     if not mileage_override and pickup_address and destination_address:
         try:
-            response = requests.get(DISTANCE_MATRIX_URL, params={
-                "origins": pickup_address,
-                "destinations": destination_address,
-                "key": GOOGLE_MAPS_API_KEY,
-                "units": "imperial"
-            })
-            if response.status_code == 200:
-                distance_data = response.json()
-                rows = distance_data.get("rows")
-                if rows:
-                    elements = rows[0].get("elements")
-                    if elements and elements[0].get("status") == "OK":
-                        distance_meters = elements[0]["distance"]["value"]
-                        distance_miles = distance_meters / 1609.34
-                        distance_miles = round(distance_miles, 2)
-                    else:
-                        print("No valid elements returned from Distance Matrix API.")
-                else:
-                    print("No valid rows returned from Distance Matrix API.")
-            else:
-                print(f"Distance API error: {response.status_code}")
+            distance_miles, distance_source = await get_distance_miles(
+                pickup_address, destination_address, parse_coordinates(current_lat, current_lng)
+            )
+            distance_miles = distance_miles or 0
         except Exception as e:
-            print(f"Distance calculation failed: {str(e)}")
+            print(f"Distance calculation failed: {describe_error(e)}")
+            distance_source = "unavailable"
 
     # Only override if a real mileage_override was provided
     if mileage_override not in (None, "", 0):
         distance_miles = mileage_override
+        distance_source = "override"
+    distance_note = {"estimate": " (estimated, Distance Matrix unavailable)", "unavailable": " (could not be calculated)"}.get(distance_source, "")
+    # Without a distance a mileage-priced move can't be quoted; it's priced by hand like a photo upload
+    distance_pending = (
+        distance_source == "unavailable"
+        and pricing_config.get(move_type, pricing_config["Home to Home"])["per_mile"] > 0
+    )
+    if distance_pending:
+        distance_miles = ""
 
     # Price Estimation
     price = 0
     stairs_charge = 0
     if not use_photos:
-        total_ft3 = sum(
-            (item["length"] * item["width"] * item["height"]) / 1728 for item in items
-        )
-        config = pricing_config.get(move_type, pricing_config["Home to Home"])
-        price = config["base"] + config["per_mile"] * distance_miles + config["per_ft3"] * total_ft3 + config["per_item"] * len(items)
-        if has_stairs:
-            stairs_charge = STAIRS_SURCHARGE
-            price += stairs_charge
+        quote = quote_move(move_type, items, distance_miles or 0, has_stairs)
+        price = 0 if distance_pending else quote["total"]
+        stairs_charge = quote["breakdown"]["stairs"]
 
-    # Save to Google Sheets
+    # Auto-assign the nearest available driver
+    assignment = None
+    try:
+        assignment = await dispatch_move(pickup_address, parse_coordinates(current_lat, current_lng), [] if use_photos else items)
+    except Exception as e:
+        print(f"Dispatch failed: {describe_error(e)}")
+
+    # Save to the local store; SheetSync appends it to the sheet
     timestamp = datetime.datetime.now().isoformat()
     
-    # Get the next empty row
-    next_row = len(worksheet.get_all_values()) + 1
-    
-    # Update the row starting from column A
-    worksheet.update(f'A{next_row}:R{next_row}', [[
-        timestamp,  # Timestamp
-        name,  # Name
-        email,  # Email
-        phone,  # Phone
-        move_type,  # Item
-        move_type,  # Move Type
-        pickup_address,  # Pickup Address
-        destination_address,  # Dropoff Address
-        formatted_date,  # Scheduled date and time of move
-        distance_miles,  # Distance
-        len(items),  # Item Count
-        ", ".join(item["item_name"] for item in items) if not use_photos else "",  # Items
-        "Yes" if use_photos else "No",  # Image upload
-        "Yes" if has_stairs else "No",  # Has Stairs
-        additional_info,  # Special Instructions
-        round(price, 2),  # Price
-        round(price * 0.7, 2),  # Driver pay (70% of total price)
-        round(price * 0.3, 2)  # Business profit (30% of total price)
-    ]])
+    await run_io("db", local_store.insert_move, {
+        "timestamp": timestamp,
+        "name": name,
+        "email": email,
+        "phone": phone,
+        "item": move_type,
+        "move_type": move_type,
+        "pickup_address": pickup_address,
+        "dropoff_address": destination_address,
+        "scheduled": formatted_date,  # Scheduled date and time of move
+        "distance": distance_miles,
+        "item_count": len(items),
+        "items": ", ".join(item["item_name"] for item in items) if not use_photos else "",
+        "image_upload": "Yes" if use_photos else "No",
+        "has_stairs": "Yes" if has_stairs else "No",
+        "special_instructions": additional_info,
+        "price": round(price, 2),
+        "driver_pay": round(price * DRIVER_SHARE, 2),  # 70% of total price
+        "business_profit": round(price * (1 - DRIVER_SHARE), 2),  # 30% of total price
+        "driver_email": assignment["email"] if assignment else "",
+    })
+    sheet_sync.wake()
 
     # Send Email to Admin
     msg = MIMEMultipart()
@@ -566,29 +3383,25 @@ Move Type: {move_type}
 Pickup Address: {pickup_address}
 Dropoff Address: {destination_address}
 Scheduled Date/Time: {formatted_date}
-Distance: {distance_miles} miles
+Distance: {'Pending' if distance_pending else f'{distance_miles} miles'}{distance_note}
 Items: {', '.join(item['item_name'] for item in items) if items else 'Uploaded Photos'}
 Has Stairs: {'Yes' if has_stairs else 'No'}
 {'Stairs Surcharge: $' + str(stairs_charge) if has_stairs else ''}
 Special Instructions: {additional_info if additional_info else 'None provided'}
 Estimated Price: ${round(price, 2) if price else 'Pending'}
+Assigned Driver: {f"{assignment['name']} <{assignment['email']}>, {assignment['miles']} miles from pickup" if assignment else 'None available, assign manually'}
 """
     msg.attach(MIMEText(body, "plain"))
 
-    if files:
-        for file in files:
-            content = await file.read()
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(content)
-            encoders.encode_base64(part)
-            part.add_header("Content-Disposition", f"attachment; filename={file.filename}")
-            msg.attach(part)
-
-    server = smtplib.SMTP("smtp.gmail.com", 587)
-    server.starttls()
-    server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-    server.send_message(msg)
-    server.quit()
+    # Photos stay in Starlette's disk spool and are encoded from there
+    attachments = [await run_io("files", prepare_attachment, file) for file in files or []]
+    if ADMIN_NOTIFY_MODE == "digest" and not is_urgent(scheduled_datetime):
+        await run_io("files", admin_digest.add, f"{name}: {move_type}, {formatted_date}", body, attachments)
+        admin_digest.wake()
+    else:
+        await run_io("db", email_outbox.enqueue, msg, attachments)
+    for _, content in attachments:
+        content.close()
 
     # Send Confirmation Email to User
     user_msg = MIMEMultipart()
@@ -607,7 +3420,7 @@ Move Type: {move_type}
 Pickup Address: {pickup_address}
 Dropoff Address: {destination_address}
 Scheduled Date/Time: {formatted_date}
-Distance: {distance_miles} miles
+Distance: {'Pending' if distance_pending else f'{distance_miles} miles'}
 Number of Items: {'Pending' if use_photos else len(items)}
 Items: {', '.join(item['item_name'] for item in items) if items else 'Uploaded Photos'}
 Has Stairs: {'Yes' if has_stairs else 'No'}
@@ -616,6 +3429,7 @@ Special Instructions: {additional_info if additional_info else 'None provided'}
 Estimated Price: ${round(price, 2) if price else 'Pending'}
 
 {('We will review your uploaded photos and send you a price quote within the next 24 hours.' if use_photos else '')}
+{('We could not calculate the driving distance between your addresses yet, so we will email you a price quote within the next 24 hours.' if distance_pending and not use_photos else '')}
 
 We're connecting you with a driver who will contact you before your scheduled move time.
 
@@ -625,14 +3439,13 @@ Thank you for choosing PikUp!
 """
     user_msg.attach(MIMEText(user_body, "plain"))
 
-    server = smtplib.SMTP("smtp.gmail.com", 587)
-    server.starttls()
-    server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-    server.send_message(user_msg)
-    server.quit()
+    await run_io("db", email_outbox.enqueue, user_msg)
+    email_outbox.wake()
 
     return {
         "status": "success",
         "estimated_price": round(price, 2) if price else "pending",
-        "distance_miles": distance_miles
+        "distance_miles": None if distance_pending else distance_miles,
+        "distance_source": distance_source,
+        "assigned_driver": assignment["name"] if assignment else None
     }